@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compare the throughput of the tokenizers in sqlport.engine.lexers and
+check that they produce the same (type, value, lineno, index) stream.
+
+usage: bench_lexer.py [--repeat N] [FILE ...]
+
+Without files a sample procedure is tokenized, repeated to about 1 MB.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlport.engine import lexers
+
+sample = """
+{ sample procedure }
+create procedure update_totals(p_id integer, p_name varchar(40))
+    returning decimal(16,2);
+    define v_total decimal(16,2);
+    define v_count, i integer;
+    let v_total = 0;
+    foreach select amount, count(*) into v_amount, v_count
+            from orders o, outer(customers c)
+            where o.customer_id = c.id and c.name matches "A*"
+            group by 1
+        let v_total = v_total + v_amount * 1.5; -- running total
+    end foreach;
+    /* done */
+    return v_total;
+end procedure;
+"""
+
+def tokens(lexer, text):
+    return [ (t.type, t.value, t.lineno, t.index) for t in lexer.tokenize(text) ]
+
+def bench(lexer, text, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for t in lexer.tokenize(text):
+            pass
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', '-n', type=int, default=3, help="runs per tokenizer, the best one counts")
+    parser.add_argument('files', metavar='FILE', nargs='*')
+    args = parser.parse_args()
+    if args.files:
+        inputs = [ (path, open(path).read()) for path in args.files ]
+    else:
+        inputs = [ ('sample', sample * ((1 << 20) // len(sample))) ]
+    for name, text in inputs:
+        reference = None
+        for lexer_name, cls in lexers.items():
+            result = tokens(cls(), text)
+            if reference is None:
+                reference = result
+            elif result != reference:
+                sys.exit("{}: {} tokens differ from {}".format(name, lexer_name, next(iter(lexers))))
+            elapsed = bench(cls(), text, args.repeat)
+            print("{:20} {:8} {:8.3f}s {:10.0f} tokens/s {:6.1f} MB/s".format(
+                name, lexer_name, elapsed, len(result) / elapsed, len(text) / elapsed / 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Time parsing, writing and rendering of the synthetic corpora of
+corpus.py, or of given files, and record the results.
+
+usage: bench_port.py [--scale N] [--repeat N] [--writer NAME] [--record FILE] [CORPUS|FILE ...]
+
+parse is engine.parse, write runs the writer over a fresh tree without
+producing output, render is Node.render of another fresh tree into a
+string, so render - write is the indentation and output. The best of
+the repeated runs counts. With --record the results are appended to
+FILE as a JSON line and compared with the last recorded run of the same
+scale and writer.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlport import __version__
+from sqlport.node import writeout, render_context
+from sqlport.engine import parse, writers
+import corpus
+
+phases = ('parse', 'write', 'render')
+
+class NullFile:
+    def write(self, text):
+        pass
+
+class ErrorCount:
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self, obj, t):
+        self.value += 1
+
+def bench(text, writer, repeat):
+    """
+    Returns the best times of the phases and the number of syntax errors.
+    """
+    best = dict.fromkeys(phases)
+    errors = ErrorCount()
+    def timed(phase, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best[phase] is None or elapsed < best[phase]:
+            best[phase] = elapsed
+        return result
+    def write(tree):
+        with render_context(writer):
+            writeout(tree.write(), NullFile())
+    for i in range(repeat):
+        # the writers change the tree, so each phase gets its own
+        tree = timed('parse', parse, text, None, 0, errors)
+        timed('write', write, tree)
+        tree = parse(text, onerror=errors)
+        timed('render', tree.render, StringIO(), writer)
+    return best, errors.value // (2 * repeat)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def last_record(path, scale, writer):
+    last = None
+    if os.path.exists(path):
+        with open(path) as fh:
+            for line in fh:
+                record = json.loads(line)
+                if record['scale'] == scale and record['writer'] == writer:
+                    last = record
+    return last
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scale', '-s', type=int, default=1, help="size factor of the generated corpora")
+    parser.add_argument('--repeat', '-n', type=int, default=3, help="runs per phase, the best one counts")
+    parser.add_argument('--writer', '-w', choices=sorted(writers), default='postgres')
+    parser.add_argument('--record', '-r', metavar='FILE', help="append the results to FILE and compare with its last run")
+    parser.add_argument('inputs', metavar='CORPUS|FILE', nargs='*',
+                        help="corpora of corpus.py ({}) or files, default all corpora".format(', '.join(corpus.corpora)))
+    args = parser.parse_args()
+    writer = writers[args.writer]
+    previous = last_record(args.record, args.scale, args.writer) if args.record else None
+    results = {}
+    for name in args.inputs or corpus.corpora:
+        if name in corpus.corpora:
+            text = corpus.generate(name, args.scale)
+        else:
+            with open(name) as fh:
+                text = fh.read()
+        best, errors = bench(text, writer, args.repeat)
+        results[name] = dict(best, bytes=len(text), errors=errors)
+        line = "{:20} {:9} bytes".format(name, len(text))
+        for phase in phases:
+            line += " {} {:8.3f}s".format(phase, best[phase])
+            if previous and name in previous['results']:
+                before = previous['results'][name][phase]
+                line += " ({:+5.1f}%)".format((best[phase] - before) / before * 100)
+        if errors:
+            line += " {} errors".format(errors)
+        print(line)
+    if args.record:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'version': __version__,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'scale': args.scale,
+            'writer': args.writer,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.record, 'a') as fh:
+            fh.write(json.dumps(record) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic Informix SQL corpora for benchmarking.
+
+usage: corpus.py [--scale N] [--seed N] DIR
+
+Writes one file per corpus to DIR. Every corpus grows linearly with the
+scale and the same seed always produces the same text.
+"""
+
+import os
+import random
+import argparse
+
+types = ['int', 'smallint', 'int8', 'serial', 'char(10)', 'varchar(40)', 'lvarchar(2000)',
+         'decimal(16,2)', 'date', 'datetime year to second', 'boolean', 'text']
+
+def expression(rnd, names, depth):
+    if depth == 0 or rnd.random() < 0.3:
+        return rnd.choice(names + ['1', "'x'", 'today', 'current'])
+    kind = rnd.random()
+    if kind < 0.4:
+        return '{} {} {}'.format(expression(rnd, names, depth - 1), rnd.choice(['+', '-', '*', '||']),
+                                 expression(rnd, names, depth - 1))
+    if kind < 0.7:
+        return 'f{}({})'.format(depth, ', '.join(expression(rnd, names, depth - 1) for i in range(rnd.randint(1, 3))))
+    if kind < 0.85:
+        return 'case when {} = {} then {} else {} end'.format(*(expression(rnd, names, depth - 1) for i in range(4)))
+    return '({})'.format(expression(rnd, names, depth - 1))
+
+def condition(rnd, names, depth):
+    return ' and '.join('{} {} {}'.format(rnd.choice(names), rnd.choice(['=', '<', '>=', '<>']),
+                                          expression(rnd, names, depth))
+                        for i in range(rnd.randint(1, 3)))
+
+def wide_tables(rnd, scale, columns=120):
+    """
+    CREATE TABLE dumps with many columns, constraints and indexes.
+    """
+    out = []
+    for n in range(20 * scale):
+        names = [ 'col{}'.format(i) for i in range(rnd.randint(columns // 2, columns)) ]
+        defs = [ '{} {}{}'.format(name, rnd.choice(types), rnd.choice(['', ' not null', " default 'x'"]))
+                 for name in names ]
+        defs.append('primary key ({})'.format(', '.join(names[:2])))
+        defs.append('unique ({})'.format(names[2]))
+        out.append('create table tab{} (\n    {}\n)'.format(n, ',\n    '.join(defs)))
+        out.append('create index ix{} on tab{} ({})'.format(n, n, ', '.join(rnd.sample(names, 3))))
+    return out
+
+def block(rnd, names, depth):
+    """
+    Statements of a procedure body, nesting FOREACH, ON EXCEPTION, IF
+    and WHILE blocks depth levels deep.
+    """
+    lines = [ 'let {} = {};'.format(rnd.choice(names), expression(rnd, names, 2)) for i in range(rnd.randint(1, 3)) ]
+    if depth == 0:
+        return lines
+    kind = rnd.choice(['foreach', 'exception', 'if', 'while'])
+    inner = block(rnd, names, depth - 1)
+    if kind == 'foreach':
+        lines.append('foreach select a, b into {}, {} from t{} where {}'.format(
+            names[0], names[1], depth, condition(rnd, ['a', 'b'], 1)))
+        lines += inner
+        lines.append('end foreach;')
+    elif kind == 'exception':
+        lines.append('begin')
+        lines.append('on exception in (-206, -958)')
+        lines += block(rnd, names, 0)
+        lines.append('end exception;')
+        lines += inner
+        lines.append('end')
+    elif kind == 'if':
+        lines.append('if {} then'.format(condition(rnd, names, 1)))
+        lines += inner
+        lines.append('else')
+        lines += block(rnd, names, 0)
+        lines.append('end if;')
+    else:
+        lines.append('while {} < 10'.format(names[0]))
+        lines += inner
+        lines.append('end while;')
+    return lines
+
+def procedures(rnd, scale, depth=12):
+    """
+    Procedures with deeply nested blocks.
+    """
+    out = []
+    for n in range(10 * scale):
+        names = [ 'v{}'.format(i) for i in range(8) ]
+        lines = ['create procedure proc{}(p_a int, p_b varchar(20)) returning int'.format(n)]
+        lines.append('define {} int;'.format(', '.join(names)))
+        for i in range(3):
+            lines += block(rnd, names, depth)
+        lines.append('return {};'.format(names[0]))
+        lines.append('end procedure')
+        out.append('\n'.join(lines))
+    return out
+
+def outer_joins(rnd, scale, tables=40):
+    """
+    Selects joining many tables with Informix OUTER.
+    """
+    out = []
+    for n in range(10 * scale):
+        count = rnd.randint(tables // 2, tables)
+        names = [ 't{}'.format(i) for i in range(count) ]
+        joins = [ names[0] ] + [ 'outer({})'.format(name) if rnd.random() < 0.7 else name for name in names[1:] ]
+        conditions = [ '{}.id = {}.ref'.format(rnd.choice(names[:i]), name) for i, name in enumerate(names) if i ]
+        columns = [ '{}.c{}'.format(rnd.choice(names), i) for i in range(10) ]
+        out.append('select {}\nfrom {}\nwhere {}'.format(
+            ', '.join(columns), ', '.join(joins), '\nand '.join(conditions)))
+    return out
+
+def merges(rnd, scale, columns=150):
+    """
+    MERGE statements updating and inserting many columns.
+    """
+    out = []
+    for n in range(20 * scale):
+        names = [ 'c{}'.format(i) for i in range(rnd.randint(columns // 2, columns)) ]
+        out.append('merge into dst{} d using src s on d.id = s.id\n'
+                   'when matched then update set {}\n'
+                   'when not matched then insert ({}) values ({})'.format(
+                       n, ',\n    '.join('d.{} = {}'.format(name, expression(rnd, ['s.' + name], 1)) for name in names),
+                       ', '.join(names), ', '.join('s.' + name for name in names)))
+    return out
+
+corpora = {
+    'tables': wide_tables,
+    'procedures': procedures,
+    'outer_joins': outer_joins,
+    'merges': merges,
+}
+
+def generate(name, scale=1, seed=1):
+    """
+    Returns the text of corpus name at scale.
+    """
+    rnd = random.Random('{}:{}'.format(name, seed))
+    return ';\n'.join(corpora[name](rnd, scale)) + ';\n'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scale', '-s', type=int, default=1, help="size factor of the corpora")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('dir', metavar='DIR')
+    args = parser.parse_args()
+    os.makedirs(args.dir, exist_ok=True)
+    for name in corpora:
+        path = os.path.join(args.dir, '{}.sql'.format(name))
+        with open(path, 'w') as fh:
+            fh.write(generate(name, args.scale, args.seed))
+        print("{} {:10} bytes".format(path, os.path.getsize(path)))
+
+if __name__ == "__main__":
+    main()
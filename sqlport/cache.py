@@ -0,0 +1,118 @@
+"""
+Persistent on-disk cache for translated SQL.
+
+Entries are keyed by a hash of the normalized input text, the writer and
+the sqlport version, so unchanged statements and files are not lexed,
+parsed or rendered again. When the cache grows beyond its size limit the
+least recently used entries are removed.
+"""
+
+import os
+import hashlib
+import tempfile
+from . import __version__
+from . import node
+
+# bump this whenever the layout of the cache entries changes
+FORMAT_VERSION = 1
+
+DEFAULT_MAX_SIZE = 256 << 20
+
+def normalize(text):
+    # white space around a statement never changes its translation
+    return text.strip()
+
+class TranslationCache:
+    def __init__(self, dirpath, max_size=DEFAULT_MAX_SIZE):
+        self.dirpath = dirpath
+        self.max_size = max_size
+        # total size of the entries, computed when first needed
+        self.size = None
+
+    def key(self, text, writer=None):
+        if writer is None:
+            writer = node.get_writer()
+        h = hashlib.sha256()
+        h.update(repr((FORMAT_VERSION, __version__, writer.__name__)).encode('utf-8'))
+        h.update(b'\0')
+        h.update(normalize(text).encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.dirpath, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Returns the output stored for key, or None.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fh:
+                output = fh.read().decode('utf-8')
+            # the modification time orders the entries for eviction
+            os.utime(path)
+        except (OSError, UnicodeDecodeError):
+            return None
+        return output
+
+    def put(self, key, output):
+        path = self.path(key)
+        dirpath = os.path.dirname(path)
+        try:
+            data = output.encode('utf-8')
+            os.makedirs(dirpath, exist_ok=True)
+            # concurrent readers must never see a partially written entry
+            fd, tmppath = tempfile.mkstemp(dir=dirpath, prefix='.')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+                os.replace(tmppath, path)
+            except BaseException:
+                os.unlink(tmppath)
+                raise
+        except (OSError, UnicodeEncodeError):
+            return False
+        if self.size is not None:
+            self.size += len(data)
+        self.evict()
+        return True
+
+    def entries(self):
+        """
+        Yields (mtime, size, path) for each entry.
+        """
+        try:
+            subdirs = list(os.scandir(self.dirpath))
+        except OSError:
+            return
+        for subdir in subdirs:
+            if len(subdir.name) != 2 or not subdir.is_dir():
+                continue
+            try:
+                for entry in os.scandir(subdir.path):
+                    if entry.name.startswith('.'):
+                        continue
+                    stat = entry.stat()
+                    yield stat.st_mtime, stat.st_size, entry.path
+            except OSError:
+                continue
+
+    def evict(self):
+        if self.size is None:
+            self.size = sum(size for mtime, size, path in self.entries())
+        if self.size <= self.max_size:
+            return
+        entries = sorted(self.entries())
+        self.size = sum(size for mtime, size, path in entries)
+        # free a quarter of the cache, so eviction does not run on every put
+        limit = self.max_size * 3 // 4
+        for mtime, size, path in entries:
+            if self.size <= limit:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self.size -= size
@@ -1,35 +1,205 @@
 
 import sys
+from io import StringIO
 from . import node
-from . writers import postgres
+from . import stats
+from . writers import postgres, informix
 from . lexer import SqlLexer, TooManyErrors
+from . scanner import SqlScanner
 from . parser import SqlParser
+from . splitter import split_statements
+from . cache import TranslationCache
+from . source import is_mapped, text_slice
 
+# the default writer, bin/sqlport and Translator select theirs per call
 node.writer = postgres.writer
 
-def parse(text, outfh=None, verbose=0, onerror=None, maxerrors=1000000):
+writers = {
+    'postgres': postgres.writer,
+    'informix': informix.writer,
+}
+
+# interchangeable tokenizers, SqlScanner is faster and yields the same tokens
+lexers = {
+    'sly': SqlLexer,
+    'scanner': SqlScanner,
+}
+
+# tokens lexed at a time while stats are collected, timing every single
+# token would slow down lexing noticeably
+token_batch = 64
+
+def parse(text, outfh=None, verbose=0, onerror=None, maxerrors=1000000, lexer=None, parser=None, lineno=1,
+          column=1):
+    """
+    Parse text, a str or a mapped source (see sqlport.source), which
+    only SqlScanner can tokenize. text starts on line lineno at column
+    column of its source.
+    """
     if not outfh:
         outfh = sys.stdout
-    lexer = SqlLexer()
-    parser = SqlParser()
-    parser.input_text = text
+    if lexer is None:
+        lexer = SqlScanner() if is_mapped(text) else SqlLexer()
+    if parser is None:
+        parser = SqlParser()
+    parser.set_input(text, lineno, column)
     if verbose:
         outfh.write("-"*80 + '\n')
-        outfh.write("{}\n\n".format(text))
-    return parser.parse(lexer.tokenize(text, onerror, maxerrors), onerror, maxerrors)
+        outfh.write("{}\n\n".format(text_slice(text, 0)))
+    tokens = lexer.tokenize(text, onerror, maxerrors, lineno)
+    collector = stats.active
+    if collector is None:
+        return parser.parse(tokens, onerror, maxerrors)
+    with collector.phase('parse'):
+        tree = parser.parse(collector.iterate('lex', tokens, 'tokens', token_batch), onerror, maxerrors)
+    collector.count_nodes(tree)
+    return tree
+
+def parse_stream(infile, outfh=None, verbose=0, onerror=None, maxerrors=1000000, lexer=None, parser=None, lineno=1,
+                 column=1):
+    """
+    Parse infile, a path or a file object, one top-level statement at a
+    time. Yields a StatementList for each statement, so only the current
+    statement has to be kept in memory.
+    """
+    if isinstance(infile, str):
+        with open(infile) as infh:
+            yield from parse_stream(infh, outfh, verbose, onerror, maxerrors, lexer, parser, lineno, column)
+        return
+    if lexer is None:
+        lexer = SqlLexer()
+    if parser is None:
+        parser = SqlParser()
+    errcount = 0
+    def count_error(obj, t):
+        nonlocal errcount
+        errcount += 1
+        if onerror:
+            onerror(obj, t)
+    for text, lineno, column in split_statements(infile, lineno=lineno, column=column):
+        yield parse(text, outfh, verbose, count_error, maxerrors - errcount, lexer, parser, lineno, column)
+
+def port_stream(infile, outfh, verbose=0, onerror=None, maxerrors=1000000, lexer=None, parser=None, cache=None,
+                writer=None, lineno=1, column=1):
+    """
+    Port infile, a path or a file object, to outfh one top-level
+    statement at a time. Yields the StatementList of each statement
+    after it has been written, or None if its output was taken from
+    cache, a TranslationCache. writer defaults to the writer of the
+    current render context, lineno and column are the position of the
+    start of infile.
+    """
+    if writer is None:
+        writer = node.get_writer()
+    if cache is None:
+        for tree in parse_stream(infile, outfh, verbose, onerror, maxerrors, lexer, parser, lineno, column):
+            tree.render(outfh, writer)
+            yield tree
+        return
+    if isinstance(infile, str):
+        with open(infile) as infh:
+            yield from port_stream(infh, outfh, verbose, onerror, maxerrors, lexer, parser, cache, writer, lineno,
+                                   column)
+        return
+    if lexer is None:
+        lexer = SqlLexer()
+    if parser is None:
+        parser = SqlParser()
+    errcount = 0
+    def count_error(obj, t):
+        nonlocal errcount
+        errcount += 1
+        if onerror:
+            onerror(obj, t)
+    for text, lineno, column in split_statements(infile, lineno=lineno, column=column):
+        key = cache.key(text, writer)
+        output = cache.get(key)
+        tree = None
+        if output is None:
+            errors = errcount
+            tree = parse(text, outfh, verbose, count_error, maxerrors - errcount, lexer, parser, lineno, column)
+            output = tree.render(None, writer)
+            if errcount == errors:
+                cache.put(key, output)
+        outfh.write(output)
+        yield tree
+
+def port_text(text, outfh, verbose=0, onerror=None, maxerrors=1000000, lexer=None, parser=None, cache=None,
+              writer=None, lineno=1, column=1):
+    """
+    Port text to outfh. With cache, a TranslationCache, the output of a
+    text seen before is taken from the cache. Otherwise the statements
+    are looked up one by one, so only the changed ones are parsed.
+    writer defaults to the writer of the current render context, lineno
+    and column are the position of the start of text.
+    """
+    if writer is None:
+        writer = node.get_writer()
+    if cache is None:
+        parse(text, outfh, verbose, onerror, maxerrors, lexer, parser, lineno, column).render(outfh, writer)
+        return
+    key = cache.key(text, writer)
+    output = cache.get(key)
+    if output is None:
+        errcount = 0
+        def count_error(obj, t):
+            nonlocal errcount
+            errcount += 1
+            if onerror:
+                onerror(obj, t)
+        buf = StringIO()
+        for tree in port_stream(StringIO(text), buf, verbose, count_error, maxerrors, lexer, parser, cache, writer,
+                                lineno, column):
+            pass
+        output = buf.getvalue()
+        if not errcount:
+            cache.put(key, output)
+    outfh.write(output)
+
+class Translator:
+    """
+    Translates SQL texts one after another with a lexer and parser that
+    are created once and reused for every call. A Translator must not be
+    shared between threads, create one per thread instead. Translators
+    with different writers may run concurrently.
+
+    writer is a writer class or a name from writers, lexer a name from
+    lexers and cache an optional TranslationCache.
+    """
+    def __init__(self, writer='postgres', onerror=None, maxerrors=1000000, cache=None, lexer='sly'):
+        if isinstance(writer, str):
+            writer = writers[writer]
+        self.writer = writer
+        self.onerror = onerror
+        self.maxerrors = maxerrors
+        self.cache = cache
+        self.lexer = lexers[lexer]()
+        self.parser = SqlParser()
+
+    def parse(self, text, lineno=1, column=1):
+        return parse(text, None, 0, self.onerror, self.maxerrors, self.lexer, self.parser, lineno, column)
+
+    def translate(self, text):
+        outfh = StringIO()
+        port_text(text, outfh, 0, self.onerror, self.maxerrors, self.lexer, self.parser, self.cache, self.writer)
+        return outfh.getvalue()
 
 def parse_file(filepath):
     print("parse {}".format(filepath))
     return parse(open(filepath).read())
 
-def lex(text, outfh=None, verbose=0, quiet=0, onerror=None):
+def lex(text, outfh=None, verbose=0, quiet=0, onerror=None, lexer=None):
     if not outfh:
         outfh = sys.stdout
     if verbose > 1:
         outfh.write("-"*80 + '\n')
-        outfh.write("{}\n\n".format(text))
-    lexer = SqlLexer()
-    for token in lexer.tokenize(text, onerror):
+        outfh.write("{}\n\n".format(text_slice(text, 0)))
+    if lexer is None:
+        lexer = SqlScanner() if is_mapped(text) else SqlLexer()
+    tokens = lexer.tokenize(text, onerror)
+    if stats.active is not None:
+        tokens = stats.active.iterate('lex', tokens, 'tokens', token_batch)
+    for token in tokens:
         if verbose:
             outfh.write(str(token)+'\n')
 
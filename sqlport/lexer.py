@@ -1,5 +1,5 @@
 
-from sys import stderr
+import sys
 from sly import Lexer
 
 keywords = set("""
@@ -25,6 +25,29 @@ START PUBLIC USAGE LANGUAGE NVL
 ELSIF LOOP LIMIT
 """.split())
 
+# maps the spellings of names seen so far to their keyword, or to None
+# for names that are no keywords, so most names are classified by a
+# single lookup without creating an uppercase copy first
+max_names = 1 << 16
+
+def initial_names():
+    names = {}
+    for keyword in keywords:
+        for spelling in (keyword, keyword.lower(), keyword.capitalize()):
+            names[spelling] = keyword
+    return names
+
+names = initial_names()
+
+def classify_name(name):
+    global names
+    upper = name.upper()
+    keyword = upper if upper in keywords else None
+    if len(names) >= max_names:
+        names = initial_names()
+    names[name] = keyword
+    return keyword
+
 class TooManyErrors(Exception):
     pass
 
@@ -164,24 +187,30 @@ class SqlLexer(Lexer):
         IN,
     }
     
-    @_(r'/\*(.|\n)+?\*/')
+    # comments are skipped by searching for the closing delimiter, at
+    # least one character after the opening one
+    @_(r'/\*')
     def ignore_multi_line_comment_1(self, t):
-        self.lineno += t.value.count('\n')
-    @_(r'{(.|\n)+?}')
+        self.skip_comment(t, '*/')
+    @_(r'{')
     def ignore_multi_line_comment_2(self, t):
-        self.lineno += t.value.count('\n')
-    ignore_line_comment = r'--.*(?=\n)'
+        self.skip_comment(t, '}')
+    ignore_line_comment = r'--[^\n]*'
     ignore = ' \t'
-    @_(r'\n+')
+    @_(r'\n[ \t\n]*')
     def ignore_newline(self, t):
-        self.lineno += len(t.value)
+        self.lineno += t.value.count('\n')
     
     # Tokens
     #NAME = r'[a-zA-Z_][a-zA-Z0-9_]*'
     @_(r'[a-zA-Z_][a-zA-Z0-9_]*')
     def NAME(self, t):
-        if t.value.upper() in keywords:
-            t.value = t.type = t.value.upper()
+        try:
+            keyword = names[t.value]
+        except KeyError:
+            keyword = classify_name(t.value)
+        if keyword:
+            t.value = t.type = keyword
         return t
 
     CONCAT = r'\|\|'
@@ -195,17 +224,32 @@ class SqlLexer(Lexer):
     STRING = r"""("[^"]*")+|('[^']*')+"""
     PG_HERE = r'\$\$'
 
-    def tokenize(self, text, onerror=None, maxerrors=1000000):
+    def tokenize(self, text, onerror=None, maxerrors=1000000, lineno=1):
         self.maxerrors = maxerrors
         self.errcount = 0
         self.onerror = onerror
-        return super().tokenize(text)
+        return super().tokenize(text, lineno)
+
+    def skip_comment(self, t, delimiter):
+        end = self.text.find(delimiter, self.index + 1)
+        if end < 0:
+            sys.stderr.write("LexError: unterminated comment at line {}\n".format(t.lineno))
+            self.index = len(self.text)
+            self.count_error(t)
+            return
+        end += len(delimiter)
+        self.lineno += self.text.count('\n', t.index, end)
+        self.index = end
 
     def error(self, t):
+        t.end = t.index + 1
         if len(t.value) > 10:
             t.value = t.value[:10] + '...'
-        stderr.write("LexError: {}\n".format(t))
+        sys.stderr.write("LexError: {}\n".format(t))
         self.index += 1
+        self.count_error(t)
+
+    def count_error(self, t):
         if self.onerror:
             self.onerror(self, t)
         self.errcount += 1
@@ -0,0 +1,97 @@
+"""
+Persistent cache for the LALR tables sly generates for a parser class.
+
+Building the tables for SqlParser takes several seconds, while loading
+them takes a few milliseconds. The cache file is keyed by a hash of the
+grammar, so the tables are rebuilt whenever a production, the precedence
+table or the token set changes.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import sly
+
+# bump this whenever the layout of the cache file changes
+FORMAT_VERSION = 1
+
+CACHE_FILE = 'parsetab.pickle'
+
+def cache_dirs():
+    yield os.environ.get('SQLPORT_LRCACHE_DIR') or os.path.join(os.path.dirname(__file__), '__pycache__')
+    yield os.path.join(os.path.expanduser('~'), '.cache', 'sqlport')
+
+def grammar_signature(cls):
+    h = hashlib.sha256()
+    def add(value):
+        h.update(repr(value).encode('utf-8'))
+        h.update(b'\0')
+    grammar = cls._grammar
+    add((FORMAT_VERSION, sly.__version__, cls.__qualname__))
+    add(sorted(cls.tokens))
+    add(grammar.Start)
+    add(sorted(grammar.Precedence.items()))
+    for p in grammar.Productions:
+        add((p.name, p.prod, p.prec))
+    return h.hexdigest()
+
+class CachedLRTable:
+    """
+    The parts of sly's LRTable used at parse time.
+    """
+    def __init__(self, grammar, lr_action, lr_goto, defaulted_states):
+        self.grammar = grammar
+        self.lr_productions = grammar.Productions
+        self.lr_action = lr_action
+        self.lr_goto = lr_goto
+        self.defaulted_states = defaulted_states
+        self.sr_conflicts = []
+        self.rr_conflicts = []
+
+def load(signature):
+    for dirpath in cache_dirs():
+        try:
+            with open(os.path.join(dirpath, CACHE_FILE), 'rb') as fh:
+                data = pickle.load(fh)
+        except Exception:
+            continue
+        if isinstance(data, tuple) and len(data) == 5 and data[:2] == (FORMAT_VERSION, signature):
+            return data[2:]
+    return None
+
+def save(signature, lrtable):
+    data = (FORMAT_VERSION, signature, lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    for dirpath in cache_dirs():
+        try:
+            os.makedirs(dirpath, exist_ok=True)
+            # write to a temporary file first, concurrent readers must
+            # never see a partially written cache file
+            fd, tmppath = tempfile.mkstemp(dir=dirpath, prefix=CACHE_FILE)
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    pickle.dump(data, fh, pickle.HIGHEST_PROTOCOL)
+                os.chmod(tmppath, 0o644)
+                os.replace(tmppath, os.path.join(dirpath, CACHE_FILE))
+            except BaseException:
+                os.unlink(tmppath)
+                raise
+            return True
+        except OSError:
+            continue
+    return False
+
+def build_lrtables(cls, build):
+    """
+    Load the LR tables of parser class cls from the cache, or create
+    them with build(cls) and store them in the cache.
+    """
+    signature = grammar_signature(cls)
+    tables = load(signature)
+    if tables:
+        cls._lrtable = CachedLRTable(cls._grammar, *tables)
+        return True
+    if not build(cls):
+        return False
+    save(signature, cls._lrtable)
+    return True
@@ -1,68 +1,254 @@
 
 import re
 from io import StringIO
+from contextlib import contextmanager
+from contextvars import ContextVar
+from . import stats
 
+# the default writer, used unless a render context selects another one
 writer = None
 
+# the dispatch table of the writer of the render context, local to the
+# current thread (and asyncio task), so concurrent renders may use
+# different writers
+context_table = ContextVar('context_table', default=None)
+
+def get_writer():
+    table = context_table.get()
+    if table is None:
+        return writer
+    return table.writer
+
+# node classes that are written by the nodes containing them, writers
+# need no function for them
+parent_written = frozenset(['NodeList', 'WhenThen'])
+
+class DispatchTable(dict):
+    """
+    Maps node classes to the functions of a writer class that write
+    them. Building the table fails with NotImplementedError if the
+    writer has no function for a node class not in parent_written.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        missing = []
+        stack = [Node]
+        while stack:
+            cls = stack.pop()
+            stack.extend(cls.__subclasses__())
+            if cls is Node:
+                continue
+            func = getattr(writer, cls.__name__, None)
+            if func is None:
+                if cls.__name__ not in parent_written:
+                    missing.append(cls.__name__)
+            else:
+                self[cls] = func
+        if missing:
+            raise NotImplementedError("{} has no function for {}".format(writer.__name__, ', '.join(sorted(missing))))
+
+    def __missing__(self, cls):
+        # node classes created after the table was built
+        func = getattr(self.writer, cls.__name__, None)
+        if func is None:
+            raise NotImplementedError("{} cannot write {}".format(self.writer.__name__, cls.__name__))
+        self[cls] = func
+        return func
+
+dispatch_tables = {}
+
+def dispatch_table(writer):
+    table = dispatch_tables.get(writer)
+    if table is None:
+        table = dispatch_tables[writer] = DispatchTable(writer)
+    return table
+
+@contextmanager
+def render_context(writer):
+    """
+    Render with writer inside the with block, in the current thread only.
+    Rendering is synchronous, so the context must not be entered in a
+    generator that yields while it is active.
+    """
+    token = context_table.set(dispatch_table(writer))
+    try:
+        yield
+    finally:
+        context_table.reset(token)
+
+# number of fragments collected before they are passed on to fh
+batch_size = 512
+
 def writeout(stream, fh):
-    while hasattr(stream, "write"):
-        stream = stream.write()
-    if isinstance(stream, str):
-        fh.write(stream)
-    else:
-        try:
-            iterator = iter(stream)
-        except TypeError:
-            return
-        for e in iterator:
-            writeout(e, fh)
+    """
+    Write stream to fh. A stream is a string, an object with a write()
+    method returning a stream, or an iterable of streams. The stream is
+    walked with an explicit stack, so deeply nested expressions do not
+    hit the recursion limit, and adjacent strings are written with a
+    single fh.write() call.
+    """
+    batch = []
+    stack = [iter((stream,))]
+    while stack:
+        for e in stack[-1]:
+            while not isinstance(e, str) and hasattr(e, "write"):
+                e = e.write()
+            if isinstance(e, str):
+                batch.append(e)
+                if len(batch) >= batch_size:
+                    fh.write(''.join(batch))
+                    batch.clear()
+                continue
+            try:
+                stack.append(iter(e))
+            except TypeError:
+                continue
+            break
+        else:
+            stack.pop()
+    if batch:
+        fh.write(''.join(batch))
+
+@stats.phase('width')
+def measure(stream, counter):
+    """
+    Like writeout, but only counts the characters written and records
+    the width of every node that has not been measured yet.
+    Line breaks are one character wide whether they break or not, so
+    Br nodes are counted without computing their level.
+    """
+    count = 0
+    # (iterator, node being measured, count at start of node)
+    stack = [(iter((stream,)), None, 0)]
+    while stack:
+        for e in stack[-1][0]:
+            if isinstance(e, str):
+                count += len(e)
+            elif isinstance(e, Br):
+                count += 1
+            elif isinstance(e, Node):
+                stack.append((iter((e.write(),)), e, count))
+                break
+            elif hasattr(e, "write"):
+                stack.append((iter((e.write(),)), None, count))
+                break
+            else:
+                try:
+                    stack.append((iter(e), None, count))
+                except TypeError:
+                    continue
+                break
+        else:
+            iterator, node, start = stack.pop()
+            if node is not None and not hasattr(node, '_width'):
+                node._width = count - start
+    counter.count += count
+
+class Counter:
+    def __init__(self):
+        self.count = 0
 
 # private-use unicode space from E000 to F8FF:
 Indent = '\ue001'
 Dedent = '\ue002'
 
-indent_regex = re.compile('[{}{}\n]|[^{}{}\n]+'.format(Indent, Dedent, Indent, Dedent), re.MULTILINE)
+marker_regex = re.compile('[\n{}{}]'.format(Indent, Dedent))
 
-class IndentSub:
-    def __init__(self, indent=2):
+class IndentWriter:
+    """
+    File like object that passes text on to fh, replacing the Indent and
+    Dedent markers by indentation at the start of each line.
+    """
+    def __init__(self, fh, indent=2):
+        self.fh = fh
         self.indent = ' ' * indent
         self.level = 0
         self.current = ''
         self.newline = False
 
-    def __call__(self, match):
-        text = match.group()
-        if text == '\n':
-            self.newline = True
-            return '\n'
-        elif text == Indent:
-            self.level += 1
-            self.current = self.indent * self.level
-            return ''
-        elif text == Dedent:
-            self.level -= 1
-            self.current = self.indent * self.level
-            return ''
-        elif self.newline:
-            self.newline = False
-            return self.current + text
-        else:
-            return text
-    
-class Node:    
+    @stats.phase('indent')
+    def write(self, text):
+        fh = self.fh
+        match = marker_regex.search(text)
+        if match is None:
+            if self.newline and text:
+                self.newline = False
+                fh.write(self.current)
+            fh.write(text)
+            return
+        pos = 0
+        for match in marker_regex.finditer(text, match.start()):
+            start = match.start()
+            if start > pos:
+                if self.newline:
+                    self.newline = False
+                    fh.write(self.current)
+                fh.write(text[pos:start])
+            marker = text[start]
+            if marker == '\n':
+                self.newline = True
+                fh.write('\n')
+            elif marker == Indent:
+                self.level += 1
+                self.current = self.indent * self.level
+            else:
+                self.level -= 1
+                self.current = self.indent * self.level
+            pos = start + 1
+        if pos < len(text):
+            if self.newline:
+                self.newline = False
+                fh.write(self.current)
+            fh.write(text[pos:] if pos else text)
+
+# attributes of every node besides the fields declared in its __slots__
+node_attributes = ('parent', 'parent_key', '_width')
+
+class NodeMeta(type):
+    """
+    Node classes declare their fields in __slots__. The node_attributes
+    are added to the first class below Node in each hierarchy (Node itself
+    has none, so NodeList can derive from list), and _fields lists the
+    fields of a class in declaration order.
+    """
+    def __new__(meta, name, bases, namespace):
+        slots = tuple(namespace.get('__slots__', ()))
+        if bases and not any(hasattr(base, 'parent') for base in bases):
+            slots += node_attributes
+        namespace['__slots__'] = slots
+        cls = super().__new__(meta, name, bases, namespace)
+        cls._fields = tuple(field for klass in reversed(cls.__mro__)
+                            for field in klass.__dict__.get('__slots__', ())
+                            if field not in node_attributes)
+        return cls
+
+@stats.phase('render')
+def write_indented(node, fh):
+    node.writeout(IndentWriter(fh))
+
+class Node(metaclass=NodeMeta):
+    __slots__ = ()
+
     def write(self, cls=None):
         if cls is None:
             cls = self.__class__
-        return getattr(writer, cls.__name__)(self)
-
-    def render(self, fh=None):
-        _fh = StringIO()
-        self.writeout(_fh)
-        text = indent_regex.sub(IndentSub(), _fh.getvalue())
+        table = context_table.get()
+        if table is None:
+            table = dispatch_table(writer)
+        return table[cls](self)
+
+    def render(self, fh=None, writer=None):
+        if writer is None and context_table.get() is None:
+            writer = get_writer()
+        if writer is not None:
+            with render_context(writer):
+                return self.render(fh)
         if fh:
-            fh.write(text)
+            write_indented(self, fh)
         else:
-            return text
+            fh = StringIO()
+            write_indented(self, fh)
+            return fh.getvalue()
 
     def writeout(self, fh=None):
         if fh:
@@ -78,26 +264,52 @@ class Node:
 
     @property
     def children(self):
-        for key, value in self.__dict__.items():
-            if key == "parent":
-                continue
+        for key in self._fields:
+            value = getattr(self, key, None)
             if isinstance(value, Node):
                 yield key, value
 
     def set_parents(self):
-        for obj, parents, path in nodewalk(self):
-            if len(parents):
-                obj.parent = parents[-1]
-                obj.parent_key = path[-1]
+        for frame in nodewalk(self):
+            if frame.up is not None:
+                frame.node.parent = frame.up.node
+                frame.node.parent_key = frame.key
+
+    def link_children(self):
+        """
+        Set the parent links below self for nodes that are not linked
+        to their current parent yet. Subtrees that are already linked
+        are not walked again.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for key, value in node.children:
+                if getattr(value, 'parent', None) is not node:
+                    value.parent = node
+                    value.parent_key = key
+                    stack.append(value)
+                elif value.parent_key != key:
+                    value.parent_key = key
+
+    def link(self, key, value):
+        if isinstance(value, Node):
+            value.parent = self
+            value.parent_key = key
+            value.link_children()
 
     def setchild(self, key, value):
         setattr(self, key, value)
+        self.link(key, value)
 
     def replace(self, new):
         assert self != new
-        self.parent.setchild(self.parent_key, new)
+        parent = self.parent
+        key = self.parent_key
+        # unlink first, new may contain self
         del self.parent
         del self.parent_key
+        parent.setchild(key, new)
 
     def detach(self, cleanup=False):
         parent = self.parent
@@ -112,15 +324,19 @@ class Node:
     def width(self):
         if not hasattr(self, '_width'):
             self._width = 0
-            self._width = len(self.writeout())
+            counter = Counter()
+            measure(self.write(), counter)
+            self._width = counter.count
         return self._width
     
 class Units(Node):
+    __slots__ = ('value', 'unit')
     def __init__(self, value, unit):
         self.value = value
         self.unit = unit
     
 class NodeList(Node, list):
+    __slots__ = ()
     def __init__(self, *nodes):
         for node in nodes:
             self.append(node)
@@ -141,14 +357,23 @@ class NodeList(Node, list):
 
     def setchild(self, key, value):
         self[key] = value
+        self.link(key, value)
+
+    def appendchild(self, value):
+        super().append(value)
+        self.link(len(self) - 1, value)
 
-class StatementList(NodeList): pass
+class StatementList(NodeList):
+    __slots__ = ()
 
-class CommaList(NodeList): pass
+class CommaList(NodeList):
+    __slots__ = ()
 
-class Indented(NodeList): pass
+class Indented(NodeList):
+    __slots__ = ()
 
 class Select(Node):
+    __slots__ = ('skip', 'first', 'distinct', 'columns', 'into_vars', 'table', 'where', 'group_by', 'having', 'order_by', 'into', 'unions')
     def __init__(self, skip, first, distinct, columns, into_vars, table, where, group_by, having, unions=None, order_by=None, into=None):
         self.skip = skip
         self.first = first
@@ -164,31 +389,37 @@ class Select(Node):
         self.unions = unions
 
 class Table(Node):
+    __slots__ = ('expr', 'name', 'columns')
     def __init__(self, expr, name=None, columns=None):
         self.expr = expr
         self.name = name
         self.columns = columns
 
 class OrderByItem(Node):
+    __slots__ = ('expr', 'dir')
     def __init__(self, expr, dir):
         self.expr = expr
         self.dir = dir
 
 class Delete(Node):
+    __slots__ = ('table', 'where')
     def __init__(self, table, where):
         self.table = table
         self.where = where
 
 class Insert(Node):
+    __slots__ = ('table', 'columns', 'values', 'select')
     def __init__(self, table, columns, values, select):
         self.table = table
         self.columns = columns
         self.values = values
         self.select = select
     
-class SubSelect(Select): pass
+class SubSelect(Select):
+    __slots__ = ()
 
 class SelectColumn(Node):
+    __slots__ = ('expr', 'name')
     def __init__(self, expr, name=None):
         self.expr = expr
         self.name = name
@@ -198,6 +429,7 @@ class SelectColumn(Node):
         return self.name.id
 
 class TableColumn(Node):
+    __slots__ = ('table', 'column')
     def __init__(self, table, column):
         self.table = table
         self.column = column
@@ -207,6 +439,7 @@ class TableColumn(Node):
         return "{}.{}".format(self.table.id, self.column.id)
 
 class Name(Node):
+    __slots__ = ('name',)
     def __init__(self, name):
         assert isinstance(name, str)
         self.name = name
@@ -216,6 +449,7 @@ class Name(Node):
         return self.name
 
 class EntityRef(Node):
+    __slots__ = ('name', 'database', 'server')
     def __init__(self, name, database=None, server=None):
         self.name = name
         self.database = database
@@ -233,6 +467,7 @@ class EntityRef(Node):
         return name.id
         
 class As(Node):
+    __slots__ = ('obj', 'name')
     def __init__(self, obj, name):
         self.obj = obj
         self.name = name
@@ -242,16 +477,19 @@ class As(Node):
         return self.name.id
 
 class SubSelectAsSelectTable(Node):
+    __slots__ = ('sub_select', 'name', 'columns')
     def __init__(self, sub_select, name, columns):
         self.sub_select = sub_select
         self.name = name
         self.columns = columns
 
 class Truncate(Node):
+    __slots__ = ('table',)
     def __init__(self, table):
         self.table = table
 
 class UpdateA(Node):
+    __slots__ = ('table', 'assignments', '_from', 'where')
     def __init__(self, table, assignments, _from, where):
         self.table = table
         self.assignments = assignments
@@ -259,6 +497,7 @@ class UpdateA(Node):
         self.where = where
 
 class UpdateB(Node):
+    __slots__ = ('table', 'columns', 'values', '_from', 'where')
     def __init__(self, table, columns, values, _from, where):
         self.table = table
         self.columns = columns
@@ -267,6 +506,7 @@ class UpdateB(Node):
         self.where = where
 
 class Merge(Node):
+    __slots__ = ('dst', 'src', 'on', 'case_list')
     def __init__(self, dst, src, on, case_list):
         self.dst = dst
         self.src = src
@@ -274,12 +514,14 @@ class Merge(Node):
         self.case_list = case_list
 
 class UpdateStatistics(Node):
+    __slots__ = ('mode', 'type', 'name')
     def __init__(self, mode, type, name):
         self.mode = mode
         self.type = type
         self.name = name
 
 class Join(Node):
+    __slots__ = ('join', 'left', 'right', 'on')
     def __init__(self, join, left, right, on):
         self.join = join
         self.left = left
@@ -287,6 +529,7 @@ class Join(Node):
         self.on = on
 
 class Call(Node):
+    __slots__ = ('name', 'args', 'statement', 'returning')
     def __init__(self, name, args, statement=False, returning=None):
         self.name = name
         self.args = args
@@ -294,18 +537,22 @@ class Call(Node):
         self.returning = returning
 
 class ExecuteImmediate(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
         
 class System(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
 class CreateRole(Node):
+    __slots__ = ('name',)
     def __init__(self, name):
         self.name = name
 
 class CreateTable(Node):
+    __slots__ = ('name', 'columns', 'temp', 'if_not_exists')
     def __init__(self, name, columns, temp=False, if_not_exists=False):
         self.name = name
         self.columns = columns
@@ -313,6 +560,7 @@ class CreateTable(Node):
         self.if_not_exists = if_not_exists
 
 class CreateTableColumn(Node):
+    __slots__ = ('name', 'ctype', 'default', 'not_null', 'primary_key')
     def __init__(self, name, ctype, default, not_null, primary_key):
         self.name = name
         self.ctype = ctype
@@ -321,107 +569,128 @@ class CreateTableColumn(Node):
         self.primary_key = primary_key
 
 class View(Node):
+    __slots__ = ('name', 'columns', 'select')
     def __init__(self, name, columns, select):
         self.name = name
         self.columns = columns
         self.select = select
 
 class RenameTable(Node):
+    __slots__ = ('table', 'name')
     def __init__(self, table, name):
         self.table = table
         self.name = name
 
 class AddConstraint(Node):
+    __slots__ = ('table', 'constraint')
     def __init__(self, table, constraint):
         self.table = table
         self.constraint = constraint
 
 class AddColumn(Node):
+    __slots__ = ('table', 'columns')
     def __init__(self, table, columns):
         self.table = table
         self.columns = columns
 
 class DropColumn(Node):
+    __slots__ = ('table', 'columns')
     def __init__(self, table, columns):
         self.table = table
         self.columns = columns
 
 class UniqueConstraint(Node):
+    __slots__ = ('name', 'columns')
     def __init__(self, name, columns):
         self.name = name
         self.columns = columns
 
 class CheckConstraint(Node):
+    __slots__ = ('name', 'expr')
     def __init__(self, name, expr):
         self.name = name
         self.expr = expr
 
 class PrimaryKeyConstraint(Node):
+    __slots__ = ('name', 'columns')
     def __init__(self, name, columns):
         self.name = name
         self.columns = columns
 
 class ForeignKeyConstraint(Node):
+    __slots__ = ('name', 'columns', 'references')
     def __init__(self, name, columns, references):
         self.name = name
         self.columns = columns
         self.references = references
 
 class Type(Node):
+    __slots__ = ('name', 'size', 'size2')
     def __init__(self, name, size=None, size2=None):
         self.name = name
         self.size = size
         self.size2 = size2
 
 class DatetimeType(Node):
+    __slots__ = ('type', 'a', 'b')
     def __init__(self, type, a=None, b=None):
         self.type = type
         self.a = a
         self.b = b
 
-class Today(Node): pass
+class Today(Node):
+    __slots__ = ()
 
 class Current(Node):
+    __slots__ = ('a', 'b')
     def __init__(self, a=None, b=None):
         self.a = a
         self.b = b
 
 class Interval(Node):
+    __slots__ = ('value', 'a', 'b')
     def __init__(self, value, a, b):
         self.value = value
         self.a = a
         self.b = b
 
 class RowType(Node):
+    __slots__ = ('type', 'not_null')
     def __init__(self, type, not_null=False):
         self.type = type
         self.not_null = not_null
 
 class MultiSetType(Node):
+    __slots__ = ('type', 'not_null')
     def __init__(self, type, not_null=False):
         self.type = type
         self.not_null = not_null
 
 class SetType(Node):
+    __slots__ = ('type', 'not_null')
     def __init__(self, type, not_null=False):
         self.type = type
         self.not_null = not_null
 
 class ListType(Node):
+    __slots__ = ('type', 'not_null')
     def __init__(self, type, not_null=False):
         self.type = type
         self.not_null = not_null
 
 class MultiSetValue(Node):
+    __slots__ = ('select',)
     def __init__(self, select):
         self.select = select
 
 class TimeUnit(Node):
+    __slots__ = ('name', 'size')
     def __init__(self, name, size=None):
         self.name = name
         self.size = size
 
 class Drop(Node):
+    __slots__ = ('kind', 'name', 'if_exists', 'arg_types')
     def __init__(self, kind, name, if_exists, arg_types):
         self.kind = kind
         self.name = name
@@ -429,15 +698,18 @@ class Drop(Node):
         self.arg_types = arg_types
 
 class LockTable(Node):
+    __slots__ = ('table', 'mode')
     def __init__(self, table, mode):
         self.table = table
         self.mode = mode
 
 class UnlockTable(Node):
+    __slots__ = ('table',)
     def __init__(self, table):
         self.table = table
 
 class CreateIndex(Node):
+    __slots__ = ('name', 'table', 'columns', 'unique', 'if_not_exists')
     def __init__(self, name, table, columns, unique, if_not_exists):
         self.name = name
         self.table = table
@@ -446,11 +718,13 @@ class CreateIndex(Node):
         self.if_not_exists = if_not_exists
 
 class CreateSynonym(Node):
+    __slots__ = ('name', 'dest')
     def __init__(self, name, dest):
         self.name = name
         self.dest = dest
 
 class CreateSequence(Node):
+    __slots__ = ('name', 'increment', 'start', 'minvalue', 'maxvalue', 'cache', 'order')
     def __init__(self, name, increment, start, minvalue, maxvalue, cache, order):
         self.name = name
         self.increment = increment
@@ -461,11 +735,13 @@ class CreateSequence(Node):
         self.order = order
         
 class AlterSequence(Node):
+    __slots__ = ('name', 'restart')
     def __init__(self, name, restart):
         self.name = name
         self.restart = restart
         
 class Operator(Node):
+    __slots__ = ('op', 'left', 'right')
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
@@ -475,15 +751,18 @@ class Operator(Node):
         return self.left is None and self.right is None
 
 class Minus(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
 class Cast(Node):
+    __slots__ = ('expr', 'to')
     def __init__(self, expr, to):
         self.expr = expr
         self.to = to
 
 class Group(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
@@ -491,37 +770,45 @@ class Group(Node):
         return self.expr is None
 
 class Union(Node):
+    __slots__ = ('type', 'select')
     def __init__(self, type, select):
         self.type = type
         self.select = select
 
 class Exists(Node):
+    __slots__ = ('select',)
     def __init__(self, select):
         self.select = select
         
 class In(Node):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
         
 class NotIn(Node):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
 class IsNull(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
 class IsNotNull(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
 class Not(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
         
 class Outer(Node):
+    __slots__ = ('expr',)
     def __init__(self, expr):
         self.expr = expr
 
@@ -530,30 +817,36 @@ class Outer(Node):
         return self.expr.id
 
 class Between(Node):
+    __slots__ = ('value', 'a', 'b')
     def __init__(self, value, a, b):
         self.value = value
         self.a = a
         self.b = b
         
-class NotBetween(Between): pass
+class NotBetween(Between):
+    __slots__ = ()
         
 class Slice(Node):
+    __slots__ = ('value', 'left', 'right')
     def __init__(self, value, left, right=None):
         self.value = value
         self.left = left
         self.right = right
 
 class Case(Node):
+    __slots__ = ('when_list', 'else_case')
     def __init__(self, when_list, else_case):
         self.when_list = when_list
         self.else_case = else_case
 
 class WhenThen(Node):
+    __slots__ = ('when', 'then')
     def __init__(self, when, then):
         self.when = when
         self.then = then
 
 class Cons(Node):
+    __slots__ = ('a', 'b')
     def __init__(self, a, b):
         self.a = a
         self.b = b
@@ -562,6 +855,7 @@ class Cons(Node):
         return self.a is None and self.b is None
 
 class CreateTrigger(Node):
+    __slots__ = ('name', 'type', 'table', 'old', 'new', 'expr', 'statement')
     def __init__(self, name, type, table, old, new, expr, statement):
         self.name = name
         self.type = type
@@ -572,6 +866,7 @@ class CreateTrigger(Node):
         self.statement = statement
         
 class CreateProcedure(Node):
+    __slots__ = ('type', 'name', 'parameters', 'returning', 'variant', 'declarations', 'statements', 'doc', 'index')
     def __init__(self, type, name, parameters, returning, variant, declarations, statements, doc):
         self.type = type
         self.name = name
@@ -583,43 +878,51 @@ class CreateProcedure(Node):
         self.doc = doc
         
 class Parameter(Node):
+    __slots__ = ('name', 'type', 'default')
     def __init__(self, name, type, default):
         self.name = name
         self.type = type
         self.default = default
 
 class Define(Node):
+    __slots__ = ('names', 'type')
     def __init__(self, names, type):
         self.names = names
         self.type = type
         
 class DefineGlobal(Node):
+    __slots__ = ('name', 'type', 'default')
     def __init__(self, name, type, default):
         self.name = name
         self.type = type
         self.default = default
 
 class Let(Node):
+    __slots__ = ('names', 'values')
     def __init__(self, names, values):
         self.names = names
         self.values = values
 
 class Return(Node):
+    __slots__ = ('values', 'resume')
     def __init__(self, values=None, resume=None):
         self.values = values
         self.resume = resume
 
 class ReturnType(Node):
+    __slots__ = ('type', 'name')
     def __init__(self, type, name):
         self.type = type
         self.name = name
 
 class If(Node):
+    __slots__ = ('cases', 'default', 'EXPR_STMT')
     def __init__(self, cases, default):
         self.cases = cases
         self.default = default
 
 class For(Node):
+    __slots__ = ('var', 'a', 'b', 'step', 'statements', 'EXPR_STMT')
     def __init__(self, var, a, b, step, statements):
         self.var = var
         self.a = a
@@ -628,57 +931,68 @@ class For(Node):
         self.statements = statements
 
 class ForEach(Node):
+    __slots__ = ('cursor', 'select', 'statements', 'record', 'variables', 'EXPR_STMT')
     def __init__(self, cursor, select, statements):
         self.cursor = cursor
         self.select = select
         self.statements = statements
         
 class While(Node):
+    __slots__ = ('expr', 'statements', 'EXPR_STMT')
     def __init__(self, expr, statements):
         self.expr = expr
         self.statements = statements
         
 class BeginEnd(Node):
+    __slots__ = ('declarations', 'statements', 'EXPR_STMT')
     def __init__(self, declarations, statements):
         self.declarations = declarations
         self.statements = statements
         
 class Exit(Node):
+    __slots__ = ('loop',)
     def __init__(self, loop):
         self.loop = loop
 
 class Continue(Node):
+    __slots__ = ('loop',)
     def __init__(self, loop):
         self.loop = loop
 
 class OnException(Node):
+    __slots__ = ('codes', 'statements', 'resume', 'EXPR_STMT')
     def __init__(self, codes, statements, resume):
         self.codes = codes
         self.statements = statements
         self.resume = resume
         
 class Raise(Node):
+    __slots__ = ('sql_error', 'isam_error', 'expr')
     def __init__(self, sql_error, isam_error, expr):
         self.sql_error = sql_error
         self.isam_error = isam_error
         self.expr = expr
                  
 class Trim(Node):
+    __slots__ = ('type', 'char', 'expr')
     def __init__(self, type, char, expr):
         self.type = type
         self.char = char
         self.expr = expr
 
 class Count(Node):
+    __slots__ = ('distinct', 'expr')
     def __init__(self, distinct, expr):
         self.distinct = distinct
         self.expr = expr
 
 class SetLockMode(Node):
+    __slots__ = ('seconds',)
     def __init__(self, seconds):
         self.seconds = seconds
 
 class Grant(Node):
+    __slots__ = ('permission', 'on', 'to', '_as')
     def __init__(self, permission, on, to, _as):
         self.permission = permission
         self.on = on
@@ -686,6 +1000,7 @@ class Grant(Node):
         self._as = _as
         
 class Revoke(Node):
+    __slots__ = ('permission', 'on', '_from', '_as')
     def __init__(self, permission, on, _from, _as):
         self.permission = permission
         self.on = on
@@ -693,78 +1008,109 @@ class Revoke(Node):
         self._as = _as
         
 class CreateAggregate(Node):
+    __slots__ = ('name', 'arglist')
     def __init__(self, name, arglist):
         self.name = name
         self.arglist = arglist
         
 class FunctionSignature(Node):
+    __slots__ = ('type', 'name', 'arg_types')
     def __init__(self, type, name, arg_types):
         self.type = type
         self.name = name
         self.arg_types = arg_types
 
 class OwnerDotName(Node):
+    __slots__ = ('owner', 'name')
     def __init__(self, owner, name):
         self.owner = owner
         self.name = name
 
 class Nvl(Node):
+    __slots__ = ('args',)
     def __init__(self, args):
         self.args = args
 
 class Matches(Node):
+    __slots__ = ('text', 'pattern', 'neg')
     def __init__(self, text, pattern, neg):
         self.text = text
         self.pattern = pattern
         self.neg = neg
 
 class Comment(Node):
+    __slots__ = ('text',)
     def __init__(self, *text):
         self.text = ' '.join([ x.writeout() if isinstance(x, Node) else str(x) for x in text ])
 
-class BlockComment(Comment): pass
+class BlockComment(Comment):
+    __slots__ = ()
     
 class NotSupported(Node):
+    __slots__ = ('args',)
     def __init__(self, *args):
         self.args = args
 
+class UnparsedStatement(Node):
+    """
+    A top-level statement that failed to parse, text is its source.
+    """
+    __slots__ = ('text',)
+    def __init__(self, text):
+        self.text = text
+
 class String(Node):
+    __slots__ = ('value',)
     def __init__(self, value):
         self.value = value
 
 class CurrentOf(Node):
+    __slots__ = ('name',)
     def __init__(self, name):
         self.name = name
 
 class SetConstraints(Node):
+    __slots__ = ('name', 'mode')
     def __init__(self, name, mode):
         self.name = name
         self.mode = mode
 
-class BeginTransaction(Node): pass
-class CommitTransaction(Node): pass
+class BeginTransaction(Node):
+    __slots__ = ()
+class CommitTransaction(Node):
+    __slots__ = ()
 
 class Substring(Node):
+    __slots__ = ('expr', 'from_', 'for_')
     def __init__(self, expr, from_, for_):
         self.expr = expr
         self.from_ = from_
         self.for_ = for_
 
 class ListExpr(Node):
+    __slots__ = ('expr_list',)
     def __init__(self, expr_list):
         self.expr_list = expr_list
 
-class Noop(Node): pass
+class Noop(Node):
+    __slots__ = ()
 
 class Br(Node):
+    __slots__ = ('node', 'thresholds', '_level')
     def __init__(self, node, *thresholds):
-        width = node.width
-        self.level = 0
-        if not thresholds:
-            thresholds = (70,)
-        for value in thresholds:
-            if width >= value:
-                self.level += 1
+        self.node = node
+        self.thresholds = thresholds or (70,)
+
+    @property
+    def level(self):
+        # computed on first use, so measuring the node does not recurse
+        if not hasattr(self, '_level'):
+            width = self.node.width
+            self._level = 0
+            for value in self.thresholds:
+                if width >= value:
+                    self._level += 1
+        return self._level
 
     def __call__(self, level=1):
         if level <= self.level:
@@ -772,34 +1118,92 @@ class Br(Node):
         else:
             return ' '
 
-# def nodewalk(obj, handler):
-#     if handler(obj):
-#         for key, value in obj.children:
-#             if isinstance(value, (list,dict)) or hasattr(value, "__dict__"):
-#                 nodewalk(value, handler)
-
-def nodewalk(obj, depthFirst=False, parents=(), path=(), done=None):
-    if done == None:
-        done = set()
-    _id = id(obj)
-    if _id in done:
+class Frame:
+    """
+    A node visited by nodewalk. Each frame links to the frame of the
+    parent node, so the chains of parents and keys are shared between
+    siblings instead of being copied for every node.
+    """
+    __slots__ = ('node', 'key', 'up')
+
+    def __init__(self, node, key=None, up=None):
+        self.node = node
+        self.key = key
+        self.up = up
+
+    @property
+    def parent(self):
+        if self.up is not None:
+            return self.up.node
+
+    @property
+    def parents(self):
+        parents = []
+        frame = self.up
+        while frame is not None:
+            parents.append(frame.node)
+            frame = frame.up
+        return tuple(reversed(parents))
+
+    @property
+    def path(self):
+        path = []
+        frame = self
+        while frame.up is not None:
+            path.append(frame.key)
+            frame = frame.up
+        return tuple(reversed(path))
+
+def nodewalk(obj, postorder=False, prune=None):
+    """
+    Walk the tree below obj without recursion and yield a Frame for
+    every node, parents before children, or children before parents if
+    postorder is set. If prune(frame) returns True, the nodes below
+    frame.node are skipped.
+    """
+    root = Frame(obj)
+    if not postorder:
+        yield root
+    if prune is not None and prune(root):
+        if postorder:
+            yield root
         return
-    done.add(_id)
-    if not depthFirst:
-        yield obj, parents, path
-    for key, value in obj.children:
-        yield from nodewalk(value, depthFirst, parents + (obj,), path + (key,))
-    if depthFirst:
-        yield obj, parents, path
+    stack = [(root, obj.children)]
+    while stack:
+        frame, children = stack[-1]
+        for key, value in children:
+            child = Frame(value, key, frame)
+            if not postorder:
+                yield child
+            if prune is not None and prune(child):
+                if postorder:
+                    yield child
+                continue
+            stack.append((child, value.children))
+            break
+        else:
+            stack.pop()
+            if postorder:
+                yield frame
 
 def find_nodes(obj, pred, recurse=False):
     if pred(obj):
         yield obj
         if not recurse:
             return
-    if isinstance(obj, Node):
-        for key, value in obj.children:
-            if callable(recurse) and not recurse(obj, key, value):
+    if not isinstance(obj, Node):
+        return
+    stack = [(obj, obj.children)]
+    while stack:
+        parent, children = stack[-1]
+        for key, value in children:
+            if callable(recurse) and not recurse(parent, key, value):
                 continue
-            if isinstance(value, Node):
-                yield from find_nodes(value, pred, recurse)
+            if pred(value):
+                yield value
+                if not recurse:
+                    continue
+            stack.append((value, value.children))
+            break
+        else:
+            stack.pop()
@@ -1,25 +1,36 @@
 
 from termcolor import colored
-from sys import stderr
+import sys
 from sly import Parser
+from sly.yacc import YaccSymbol
 from . lexer import SqlLexer, TooManyErrors
 from . node import *
 from . logger import Logger
+from . import lrcache
+from . source import LineIndex, text_slice
 
 def find_column(text, token):
-    last_cr = text.rfind('\n', 0, token.index)
-    if last_cr < 0:
-        last_cr = 0
-    column = (token.index - last_cr) + 1
-    return column
+    """
+    Returns the 1-based column of token in text, a source or the
+    LineIndex of one.
+    """
+    if not isinstance(text, LineIndex):
+        text = LineIndex(text)
+    return text.position(token.index)[1]
 
 class SqlParser(Parser):
     #debugfile = 'parser.out'
 
-    log = Logger(stderr)
+    log = Logger(sys.stderr)
     
     tokens = SqlLexer.tokens
 
+    # sly builds the LR tables while creating the class, overriding its
+    # private builder lets us load them from a cache file instead
+    @classmethod
+    def _Parser__build_lrtables(cls):
+        return lrcache.build_lrtables(cls, Parser._Parser__build_lrtables.__func__)
+
     precedence = (
 #        ('left', ',', JOIN),
         ('left', OR),
@@ -41,9 +52,9 @@ class SqlParser(Parser):
     @_('toplevel')
     def toplevel_list(self, p):
         return StatementList(p.toplevel)
-    @_('toplevel ";" toplevel_list')
+    @_('toplevel_list ";" toplevel')
     def toplevel_list(self, p):
-        return p.toplevel_list.push(p.toplevel)
+        return p.toplevel_list.append(p.toplevel)
 
     @_('statement')
     def toplevel(self, p):
@@ -177,9 +188,9 @@ class SqlParser(Parser):
     def with_variant(self, p):
         pass
 
-    @_('parameter "," parameter_list')
+    @_('parameter_list "," parameter')
     def parameter_list(self, p):
-        return p.parameter_list.push(p.parameter)
+        return p.parameter_list.append(p.parameter)
     @_('parameter')
     def parameter_list(self, p):
         return CommaList(p.parameter)
@@ -204,9 +215,9 @@ class SqlParser(Parser):
     @_('return_type')
     def returning_list(self, p):
         return CommaList(p.return_type)
-    @_('return_type "," returning_list')
+    @_('returning_list "," return_type')
     def returning_list(self, p):
-        return p.returning_list.push(p.return_type)
+        return p.returning_list.append(p.return_type)
 
     @_('type_expr')
     def return_type(self, p):
@@ -215,12 +226,9 @@ class SqlParser(Parser):
     def return_type(self, p):
         return ReturnType(p.type_expr, p.name)
 
-    @_('declare_step')
-    def declare_list(self, p):
-        return StatementList(p.declare_step)
-    @_('declare_step declare_list')
+    @_('declare_list declare_step')
     def declare_list(self, p):
-        return p.declare_list.push(p.declare_step)
+        return p.declare_list.append(p.declare_step)
     @_('empty')
     def declare_list(self, p):
         return StatementList()
@@ -236,12 +244,9 @@ class SqlParser(Parser):
     def declare_stmt(self, p):
         return DefineGlobal(p.name, p.type_expr, p.expr)
 
-    @_('proc_step')
-    def proc_list(self, p):
-        return StatementList(p.proc_step)
-    @_('proc_step proc_list')
+    @_('proc_list proc_step')
     def proc_list(self, p):
-        return p.proc_list.push(p.proc_step)
+        return p.proc_list.append(p.proc_step)
     @_('empty')
     def proc_list(self, p):
         return StatementList()
@@ -313,9 +318,9 @@ class SqlParser(Parser):
     @_('let_expr')
     def let_list(self, p):
         return CommaList(p.let_expr)
-    @_('let_expr "," let_list')
+    @_('let_list "," let_expr')
     def let_list(self, p):
-        return p.let_list.push(p.let_expr)
+        return p.let_list.append(p.let_expr)
 
     @_('name "[" UINT "," UINT "]"')
     def let_expr(self, p):
@@ -368,7 +373,7 @@ class SqlParser(Parser):
         return NodeList(p.STRING)
     @_('string_list "," STRING')
     def string_list(self, p):
-        return p.string_list.push(p.STRING)
+        return p.string_list.append(p.STRING)
 
     @_('execute_procedure entity_ref "(" args ")" call_returning')
     def call_stmt(self, p):
@@ -469,9 +474,9 @@ class SqlParser(Parser):
     @_('merge_case')
     def merge_case_list(self, p):
         return NodeList(p.merge_case)
-    @_('merge_case merge_case_list')
+    @_('merge_case_list merge_case')
     def merge_case_list(self, p):
-        return p.merge_case_list.push(p.merge_case)
+        return p.merge_case_list.append(p.merge_case)
 
     @_('WHEN MATCHED THEN UPDATE SET assignment_list')
     def merge_case(self, p):
@@ -493,9 +498,9 @@ class SqlParser(Parser):
     @_('assignment')
     def assignment_list(self, p):
         return NodeList(p.assignment)
-    @_('assignment "," assignment_list')
+    @_('assignment_list "," assignment')
     def assignment_list(self, p):
-        return p.assignment_list.push(p.assignment)
+        return p.assignment_list.append(p.assignment)
 
     @_('name_or_table_column "=" expr')
     def assignment(self, p):
@@ -576,9 +581,9 @@ class SqlParser(Parser):
     @_('return_type')
     def arg_type_list(self, p):
         return NodeList(p.return_type)
-    @_('return_type "," arg_type_list')
+    @_('arg_type_list "," return_type')
     def arg_type_list(self, p):
-        return p.arg_type_list.push(p.return_type)
+        return p.arg_type_list.append(p.return_type)
     @_('empty')
     def arg_type_list(self, p):
         return NodeList()
@@ -727,9 +732,9 @@ class SqlParser(Parser):
     @_('name_or_table_column')
     def column_list(self, p):
         return CommaList(p.name_or_table_column)
-    @_('name_or_table_column "," column_list')
+    @_('column_list "," name_or_table_column')
     def column_list(self, p):
-        return p.column_list.push(p.name_or_table_column)
+        return p.column_list.append(p.name_or_table_column)
 
     @_('name', 'table_column')
     def name_or_table_column(self, p):
@@ -738,9 +743,9 @@ class SqlParser(Parser):
     @_('name')
     def name_list(self, p):
         return CommaList(p.name)
-    @_('name "," name_list')
+    @_('name_list "," name')
     def name_list(self, p):
-        return p.name_list.push(p.name)
+        return p.name_list.append(p.name)
 
     @_('CREATE temp TABLE if_not_exists entity_name "(" create_table_item_list ")"')
     def create_table(self, p):
@@ -761,9 +766,9 @@ class SqlParser(Parser):
     @_('create_table_item')
     def create_table_item_list(self, p):
         return CommaList(p.create_table_item)
-    @_('create_table_item "," create_table_item_list')
+    @_('create_table_item_list "," create_table_item')
     def create_table_item_list(self, p):
-        return p.create_table_item_list.push(p.create_table_item)
+        return p.create_table_item_list.append(p.create_table_item)
 
     @_('create_table_column')
     def create_table_item(self, p):
@@ -1050,9 +1055,9 @@ class SqlParser(Parser):
     @_('select_column')
     def select_column_list(self, p):
         return CommaList(p.select_column)
-    @_('select_column "," select_column_list')
+    @_('select_column_list "," select_column')
     def select_column_list(self, p):
-        return p.select_column_list.push(p.select_column)
+        return p.select_column_list.append(p.select_column)
     
     @_('expr AS name')
     def select_column(self, p):
@@ -1067,9 +1072,9 @@ class SqlParser(Parser):
     @_('expr')
     def expr_list(self, p):
         return CommaList(p.expr)
-    @_('expr "," expr_list')
+    @_('expr_list "," expr')
     def expr_list(self, p):
-        return p.expr_list.push(p.expr)
+        return p.expr_list.append(p.expr)
     
     @_('NVL "(" args ")"')
     def expr(self, p):
@@ -1227,9 +1232,9 @@ class SqlParser(Parser):
     @_('case_when')
     def case_when_list(self, p):
         return NodeList(p.case_when)
-    @_('case_when case_when_list')
+    @_('case_when_list case_when')
     def case_when_list(self, p):
-        return p.case_when_list.push(p.case_when)
+        return p.case_when_list.append(p.case_when)
 
     @_('WHEN expr THEN expr')
     def case_when(self, p):
@@ -1400,19 +1405,109 @@ class SqlParser(Parser):
         self.maxerrors = maxerrors
         self.errcount = 0
         self.onerror = onerror
-        return super().parse(tokens)
+        # position maps are keyed by id() and would otherwise grow
+        # (and go stale) when a parser instance is reused
+        self._line_positions = {}
+        self._index_positions = {}
+        tree = super().parse(tokens)
+        if isinstance(tree, Node):
+            # the links are kept up to date by setchild, replace and
+            # detach from here on
+            tree.set_parents()
+        return tree
+
+    def set_input(self, text, lineno=1, column=1):
+        """
+        Sets the text the next tokens come from, starting on line lineno
+        at column column, for error messages and positions.
+        """
+        self.lines = LineIndex(text, lineno, column)
+
+    @property
+    def input_text(self):
+        return self.lines.source
+
+    @input_text.setter
+    def input_text(self, text):
+        self.set_input(text)
+
+    def position(self, index):
+        """
+        Returns the line and column of index, the offset of a token or
+        node in the input text.
+        """
+        return self.lines.position(index)
 
     def error(self, t):
         txt = self.input_text
-        stderr.write("Syntax Error [state {}] {}\n".format(self.state, t))
+        sys.stderr.write("Syntax Error [state {}] {}\n".format(self.state, t))
         if t != None:
-            line_start = txt.rfind('\n', 0, t.index) + 1
-            line_end = txt.find('\n', t.index)
-            stderr.write(colored(txt[line_start:t.index], 'yellow'))
-            stderr.write(colored(txt[t.index:t.index+len(t.value)], 'red'))
-            stderr.write(colored(txt[t.index+len(t.value):line_end]+'\n', 'yellow'))
+            line_start, line_end = self.lines.bounds(t.index)
+            if line_start == 0:
+                # keep the column of a text that starts inside a line
+                sys.stderr.write(' ' * (self.lines.first_column - 1))
+            sys.stderr.write(colored(text_slice(txt, line_start, t.index), 'yellow'))
+            sys.stderr.write(colored(text_slice(txt, t.index, t.end), 'red'))
+            sys.stderr.write(colored(text_slice(txt, t.end, max(line_end, t.end))+'\n', 'yellow'))
         if self.onerror:
             self.onerror(self, t)
         self.errcount += 1
         if self.errcount >= self.maxerrors:
             raise TooManyErrors()
+        return self.recover(t)
+
+    def recover(self, t):
+        """
+        Panic mode recovery: skips the tokens up to the ';' that ends the
+        statement containing t, or up to END PROCEDURE in a procedure, and
+        replaces the statement with an UnparsedStatement holding its
+        source. Returns the ';' or the end of input as the next lookahead.
+        """
+        symstack, statestack = self.symstack, self.statestack
+        types = [ sym.type for sym in symstack ]
+        # the stack holds '$end', the statements so far and the ';' after
+        # them, and the part of the failed statement that was parsed
+        if types[1:3] == ['toplevel_list', ';']:
+            keep, start, partial = 2, symstack[2].end, types[3:]
+        elif types[1:2] == ['toplevel_list'] and t is not None:
+            keep, start, partial = 2, t.index, types[2:]
+        else:
+            keep, start, partial = 1, 0, types[1:]
+        if t is not None:
+            partial.append(t.type)
+        procedure_words = ('procedure', 'PROCEDURE', 'FUNCTION')
+        in_procedure = partial[:1] == ['CREATE'] and partial[1:2] in (['procedure'], ['PROCEDURE'], ['FUNCTION'])
+        if in_procedure:
+            # after END PROCEDURE the error follows the procedure
+            in_procedure = not any(a == 'END' and b in procedure_words for a, b in zip(partial[2:], partial[3:]))
+        prev = types[-1]
+        while t is not None:
+            if in_procedure:
+                if prev == 'END' and t.type in ('PROCEDURE', 'FUNCTION'):
+                    in_procedure = False
+            elif t.type == ';':
+                break
+            prev = t.type
+            t = next(self.tokens, None)
+        if t is None:
+            end = len(self.input_text)
+            t = YaccSymbol()
+            t.type = '$end'
+        else:
+            end = t.index
+        stmt = UnparsedStatement(text_slice(self.input_text, start, end).strip())
+        del symstack[keep:]
+        del statestack[keep:]
+        if keep == 2:
+            symstack[1].value.append(stmt)
+        else:
+            sym = YaccSymbol()
+            sym.type = 'toplevel_list'
+            sym.value = StatementList(stmt)
+            sym.lineno = self.position(start)[0]
+            sym.index = start
+            sym.end = end
+            symstack.append(sym)
+            statestack.append(self._lrtable.lr_goto[0]['toplevel_list'])
+        self.state = statestack[-1]
+        return t
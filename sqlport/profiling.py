@@ -0,0 +1,86 @@
+"""
+Profile porting with cProfile and write the statistics both as a pstats
+file and as collapsed stacks, the input format of flamegraph.pl and
+speedscope.
+
+cProfile records callers and callees but not whole stacks, so the
+stacks are rebuilt from the call graph: the time of a function called
+from several places is split between them in proportion to the time
+spent in each call. Branches below min_fraction of the total time are
+left out.
+"""
+
+import os
+import cProfile
+import pstats
+from time import perf_counter
+from contextlib import contextmanager
+
+min_fraction = 0.0005
+
+def label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # built-in functions
+        return name
+    return '{} ({}:{})'.format(name, os.path.basename(filename), lineno)
+
+def collapsed_stacks(stats):
+    """
+    Yields (stack, microseconds) for the stacks of stats, a pstats.Stats,
+    where stack is the labels of the functions joined by ';'.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [ func for func, entry in entries.items() if not entry[4] ]
+    limit = sum(entries[func][3] for func in roots) * min_fraction
+    times = {}
+    # (function, time spent in it on this path, functions on the path, labels)
+    stack = [ (func, entries[func][3], (), ()) for func in roots ]
+    while stack:
+        func, time, funcs, labels = stack.pop()
+        cc, nc, tt, ct, callers = entries[func]
+        ratio = min(time / ct, 1.0) if ct else 0.0
+        funcs += (func,)
+        labels += (label(func),)
+        path = ';'.join(labels)
+        times[path] = times.get(path, 0.0) + tt * ratio
+        for callee, edge_time in callees.get(func, ()):
+            # a recursive call is already counted for the outer call
+            if callee not in funcs and edge_time * ratio >= limit:
+                stack.append((callee, edge_time * ratio, funcs, labels))
+    for path, time in sorted(times.items()):
+        microseconds = int(time * 1e6)
+        if microseconds:
+            yield path, microseconds
+
+def dump(profiler, path):
+    """
+    Writes path.pstats and path.collapsed.
+    """
+    dirpath = os.path.dirname(path)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+    profiler.dump_stats(path + '.pstats')
+    with open(path + '.collapsed', 'w') as fh:
+        for stack, microseconds in collapsed_stacks(pstats.Stats(profiler)):
+            fh.write('{} {}\n'.format(stack, microseconds))
+
+@contextmanager
+def profile(path, threshold=0.0):
+    """
+    Profiles the with block and dumps the result to path if the block
+    took at least threshold seconds, measured while profiling.
+    """
+    profiler = cProfile.Profile()
+    start = perf_counter()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if perf_counter() - start >= threshold:
+            dump(profiler, path)
@@ -0,0 +1,244 @@
+"""
+A faster scanner for the token set of SqlLexer.
+
+SqlScanner produces the same tokens as SqlLexer, but matches blanks as
+part of each token with a single regex built from the rules of SqlLexer
+and handles every token kind inline instead of calling a method per
+token.
+"""
+
+import re
+import sys
+from . import lexer
+from . lexer import SqlLexer, TooManyErrors
+from . source import encoding, is_mapped, text_slice
+
+# token functions of SqlLexer that SqlScanner handles inline
+handled_funcs = {'multi_line_comment_1', 'multi_line_comment_2', 'newline', 'NAME'}
+
+ignored = SqlLexer._ignored_tokens
+
+# literals that are not the first character of any other token
+punctuation = ';,()[]'
+
+# the block comments SqlLexer skips in a token function, matched
+# completely
+comment_patterns = {
+    'multi_line_comment_1': r'/\*[\s\S][^*]*\*+(?:[^/*][^*]*\*+)*/',
+    'multi_line_comment_2': r'\{[\s\S][^}]*\}',
+}
+
+def scanner_pattern():
+    """
+    The rules of SqlLexer combined into a regex that matches at every
+    position: blanks are skipped in front of each token, block comments
+    are matched completely (at least one character after the opening
+    delimiter, like SqlLexer), and literals and invalid characters are
+    matched last. The most frequent tokens, names and punctuation that
+    cannot start any other token, are tried first.
+    """
+    rules = [
+        '(?P<NAME>{})'.format(SqlLexer.NAME.pattern),
+        '(?P<punctuation>[{}])'.format(re.escape(punctuation)),
+    ]
+    for name, value in SqlLexer._rules:
+        if name.startswith('ignore_'):
+            name = name[7:]
+        pattern = getattr(value, 'pattern', value)
+        if callable(value) and name not in handled_funcs:
+            raise TypeError('SqlScanner does not handle the token function {}'.format(name))
+        if name == 'NAME':
+            continue
+        pattern = comment_patterns.get(name, pattern)
+        rules.append('(?P<{}>{})'.format(name, pattern))
+    rules.append(r'(?P<unterminated_comment>/\*|\{)')
+    rules.append('(?P<literal>[{}])'.format(''.join(re.escape(x) for x in sorted(SqlLexer.literals))))
+    ignore = re.escape(SqlLexer.ignore)
+    rules.append('(?P<error>[^{}])'.format(ignore))
+    return '[{}]*(?:{})'.format(ignore, '|'.join(rules))
+
+token_regex = re.compile(scanner_pattern(), SqlLexer.reflags)
+
+# the same for a mapped source, an invalid character is a whole UTF-8 sequence
+bytes_token_regex = re.compile(
+    scanner_pattern().replace('(?P<error>', r'(?P<error>[\xc0-\xff][\x80-\xbf]*|').encode('ascii'),
+    SqlLexer.reflags)
+
+class Token:
+    """
+    A token of SqlScanner, with the attributes of a sly Token. Only the
+    source and the position are stored, the value of a token is sliced
+    from the source when the parser first asks for it. Names, keywords
+    and literals carry their value, the scanner needs it anyway.
+    """
+    __slots__ = ('type', 'lineno', 'index', 'end', 'source', '_value')
+
+    @property
+    def value(self):
+        value = self._value
+        if value is None:
+            value = self._value = self.source[self.index:self.end]
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    def __repr__(self):
+        return f'Token(type={self.type!r}, value={self.value!r}, lineno={self.lineno}, index={self.index}, end={self.end})'
+
+class MappedToken(Token):
+    """
+    A token of a mapped source, its value is decoded when it is sliced.
+    """
+    __slots__ = ()
+
+    @property
+    def value(self):
+        value = self._value
+        if value is None:
+            value = self._value = self.source[self.index:self.end].decode(encoding)
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+# maps the bytes of names seen in mapped sources to (keyword, value)
+byte_names = {}
+
+def classify_bytes(name):
+    if len(byte_names) >= lexer.max_names:
+        byte_names.clear()
+    value = name.decode('ascii')
+    keyword = lexer.names.get(value, False)
+    if keyword is False:
+        keyword = lexer.classify_name(value)
+    result = byte_names[name] = (keyword, keyword or value)
+    return result
+
+class SqlScanner:
+    """
+    Tokenizes like SqlLexer.tokenize, one regex match per token. text
+    may also be a mapped source (see sqlport.source), then the token
+    positions are byte offsets.
+    """
+    def tokenize(self, text, onerror=None, maxerrors=1000000, lineno=1):
+        self.text = text
+        self.maxerrors = maxerrors
+        self.errcount = 0
+        self.onerror = onerror
+        if is_mapped(text):
+            return self.tokenize_mapped(text, lineno)
+        return self.tokenize_text(text, lineno)
+
+    def tokenize_text(self, text, lineno):
+        names = lexer.names
+        new = Token.__new__
+        for m in token_regex.finditer(text):
+            kind = m.lastgroup
+            if kind == 'NAME':
+                value = m[kind]
+                try:
+                    keyword = names[value]
+                except KeyError:
+                    keyword = lexer.classify_name(value)
+                    names = lexer.names
+                tok = new(Token)
+                if keyword:
+                    tok.type = tok._value = keyword
+                else:
+                    tok.type = 'NAME'
+                    tok._value = value
+            elif kind == 'punctuation' or kind == 'literal':
+                tok = new(Token)
+                tok.type = tok._value = m[kind]
+            elif kind == 'newline':
+                lineno += m[kind].count('\n')
+                continue
+            elif kind in ignored:
+                lineno += m[kind].count('\n')
+                continue
+            elif kind == 'error':
+                self.error(m.start(kind), lineno)
+                continue
+            elif kind == 'unterminated_comment':
+                self.unterminated_comment(m, lineno)
+                break
+            else:
+                tok = new(Token)
+                tok.type = kind
+                tok._value = None
+            tok.lineno = lineno
+            tok.index = m.start(kind)
+            tok.end = m.end()
+            tok.source = text
+            yield tok
+
+    def tokenize_mapped(self, text, lineno):
+        names = byte_names
+        new = MappedToken.__new__
+        for m in bytes_token_regex.finditer(text):
+            kind = m.lastgroup
+            if kind == 'NAME':
+                try:
+                    keyword, value = names[m[kind]]
+                except KeyError:
+                    keyword, value = classify_bytes(m[kind])
+                tok = new(MappedToken)
+                tok.type = keyword or 'NAME'
+                tok._value = value
+            elif kind == 'punctuation' or kind == 'literal':
+                tok = new(MappedToken)
+                tok.type = tok._value = m[kind].decode('ascii')
+            elif kind == 'newline':
+                lineno += m[kind].count(b'\n')
+                continue
+            elif kind in ignored:
+                lineno += m[kind].count(b'\n')
+                continue
+            elif kind == 'error':
+                self.error(m.start(kind), lineno)
+                continue
+            elif kind == 'unterminated_comment':
+                self.unterminated_comment(m, lineno)
+                break
+            else:
+                tok = new(MappedToken)
+                tok.type = kind
+                tok._value = None
+            tok.lineno = lineno
+            tok.index = m.start(kind)
+            tok.end = m.end()
+            tok.source = text
+            yield tok
+
+    def unterminated_comment(self, m, lineno):
+        sys.stderr.write("LexError: unterminated comment at line {}\n".format(lineno))
+        t = Token()
+        t.type = 'ERROR'
+        t.value = text_slice(m.string, m.start(m.lastgroup), m.end())
+        t.lineno = lineno
+        t.index = m.start(m.lastgroup)
+        t.end = m.end()
+        self.count_error(t)
+
+    def error(self, pos, lineno):
+        t = Token()
+        t.type = 'ERROR'
+        # enough for ten characters even of a mapped source
+        t.value = text_slice(self.text, pos, pos + 44)
+        t.lineno = lineno
+        t.index = pos
+        t.end = pos + 1
+        if len(t.value) > 10:
+            t.value = t.value[:10] + '...'
+        sys.stderr.write("LexError: {}\n".format(t))
+        self.count_error(t)
+
+    def count_error(self, t):
+        if self.onerror:
+            self.onerror(self, t)
+        self.errcount += 1
+        if self.errcount >= self.maxerrors:
+            raise TooManyErrors()
@@ -0,0 +1,99 @@
+"""
+Access to SQL source text that is either a str or a read-only memory
+map of a file.
+
+Positions in a mapped source are byte offsets and mapped files are
+decoded as UTF-8 where text is needed, so only the parts of a huge file
+that are actually looked at are copied to the Python heap.
+"""
+
+import re
+import mmap
+from array import array
+from bisect import bisect_right
+
+encoding = 'utf-8'
+
+def map_file(path):
+    """
+    Returns a read-only memory map of the file at path, or b'' for an
+    empty file, which cannot be mapped.
+    """
+    with open(path, 'rb') as fh:
+        try:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b''
+
+def is_mapped(source):
+    return isinstance(source, (bytes, mmap.mmap))
+
+def text_slice(source, start, end=None):
+    """
+    Returns source[start:end] as a str.
+    """
+    text = source[start:end]
+    if isinstance(text, bytes):
+        text = text.decode(encoding, 'replace')
+    return text
+
+newline_regex = re.compile('\n')
+bytes_newline_regex = re.compile(b'\n')
+
+class LineIndex:
+    """
+    Maps offsets into source to lines and columns by binary search in
+    the offsets of the line starts. The line starts are recorded on
+    demand, only as far into source as the lookups so far needed, so
+    each part of source is scanned at most once however many positions
+    are looked up. first_line is the number of the first line of source
+    and first_column the column source starts at on that line.
+    """
+    def __init__(self, source, first_line=1, first_column=1):
+        self.source = source
+        self.first_line = first_line
+        self.first_column = first_column
+        self.starts = array('q', [0])
+        self.scanned = 0
+        self.newlines = bytes_newline_regex if is_mapped(source) else newline_regex
+
+    def scan(self, index):
+        # records the line starts up to the first one after index
+        if self.scanned > index:
+            return
+        starts = self.starts
+        for m in self.newlines.finditer(self.source, self.scanned):
+            starts.append(m.end())
+            if m.end() > index:
+                self.scanned = m.end()
+                return
+        self.scanned = len(self.source) + 1
+
+    def line_number(self, index):
+        """
+        Returns the 0-based number of the line of source containing index.
+        """
+        self.scan(index)
+        return bisect_right(self.starts, index) - 1
+
+    def bounds(self, index):
+        """
+        Returns the start and end offsets of the line containing index,
+        the end excludes the newline.
+        """
+        n = self.line_number(index)
+        starts = self.starts
+        end = starts[n + 1] - 1 if n + 1 < len(starts) else len(self.source)
+        return starts[n], end
+
+    def position(self, index):
+        """
+        Returns the line and the 1-based column of index. Columns count
+        characters, in a mapped source the line up to index is decoded.
+        """
+        n = self.line_number(index)
+        start = self.starts[n]
+        width = index - start
+        if self.newlines is bytes_newline_regex:
+            width = len(text_slice(self.source, start, index))
+        return self.first_line + n, width + (self.first_column if n == 0 else 1)
@@ -0,0 +1,130 @@
+"""
+Split SQL read from a file object into top-level statements without
+reading the whole file into memory.
+
+The scanner follows the comment and string rules of SqlLexer, keeps
+CREATE PROCEDURE ... END PROCEDURE bodies together and does not split
+inside $$ quoted text.
+"""
+
+import re
+from . lexer import SqlLexer
+from . scanner import comment_patterns
+
+def splitter_pattern():
+    """
+    The comment, string, name and $$ rules of SqlLexer combined into a
+    regex matching the tokens that matter for splitting, a $$ quoted
+    text as a whole.
+    """
+    rules = dict(SqlLexer._rules)
+    def rule(name):
+        return comment_patterns.get(name) or getattr(rules[name], 'pattern', rules[name])
+    here = rule('PG_HERE')
+    return '|'.join([
+        '(?P<comment>{}|{}|{})'.format(rule('multi_line_comment_1'), rule('multi_line_comment_2'),
+                                       rule('ignore_line_comment')),
+        '(?P<string>{})'.format(rule('STRING')),
+        r'(?P<here>{0}[\s\S]*?{0})'.format(here),
+        '(?P<word>{})'.format(rule('NAME')),
+        '(?P<semicolon>;)',
+        r'(?P<space>\s+)',
+        r'(?P<other>[^a-zA-Z_;"\'{/$\s-]+|[\s\S])',
+    ])
+
+token_regex = re.compile(splitter_pattern(), SqlLexer.reflags)
+
+# characters that may start a token spanning several lines
+openers = ('/*', '{', '"', "'", '$$')
+
+procedure_words = ('PROCEDURE', 'FUNCTION')
+
+def split_statements(infh, blocksize=1<<16, lineno=1, column=1):
+    """
+    Yields (text, lineno, column) for each top-level statement read
+    from infh, where lineno and column are the position the text starts
+    at, counting from the given lineno and column for the start of
+    infh. The terminating semicolon is not included and statements
+    without any tokens are skipped.
+    """
+    buf = ''
+    start = pos = 0
+    eof = False
+    head = []
+    prev = None
+    in_procedure = False
+    significant = False
+    while True:
+        m = token_regex.match(buf, pos)
+        if not eof and (m is None or m.end() == len(buf) or
+                        (m.lastgroup == 'other' and buf.startswith(openers, pos))):
+            # the token at pos may continue in the next block
+            block = infh.read(max(blocksize, len(buf) - start))
+            if not block:
+                eof = True
+            buf = buf[start:] + block
+            pos -= start
+            start = 0
+            continue
+        if m is None:
+            break
+        kind = m.lastgroup
+        pos = m.end()
+        if kind == 'semicolon' and not in_procedure:
+            if significant:
+                yield buf[start:m.start()], lineno, column
+            newline = buf.rfind('\n', start, pos)
+            if newline < 0:
+                column += pos - start
+            else:
+                lineno += buf.count('\n', start, pos)
+                column = pos - newline
+            start = pos
+            head = []
+            prev = None
+            significant = False
+        elif kind == 'word':
+            word = m.group().upper()
+            if len(head) < 2:
+                head.append(word)
+                if head[0] == 'CREATE' and word in procedure_words:
+                    in_procedure = True
+            elif in_procedure and prev == 'END' and word in procedure_words:
+                in_procedure = False
+            prev = word
+            significant = True
+        elif kind == 'here':
+            # a postgres function body, there is no END PROCEDURE to wait for
+            in_procedure = False
+            significant = True
+        elif kind in ('string', 'other'):
+            significant = True
+    if significant:
+        yield buf[start:], lineno, column
+
+def split_chunks(infh, size=1<<20, blocksize=1<<16):
+    """
+    Yields (text, lineno, column) for runs of consecutive top-level
+    statements read from infh, each about size characters long. A chunk can be
+    parsed on its own and the outputs of the chunks, concatenated in
+    order, are the output of the whole file. Statements are separated
+    by ';' and the newlines of skipped empty statements are kept, so
+    tokens keep their positions.
+    """
+    parts = []
+    length = 0
+    first = line = None
+    for text, lineno, column in split_statements(infh, blocksize):
+        if parts:
+            parts.append(';' + '\n' * (lineno - line))
+        else:
+            first = lineno, column
+        parts.append(text)
+        length += len(text)
+        line = lineno + text.count('\n')
+        if length >= size:
+            yield (''.join(parts),) + first
+            parts = []
+            length = 0
+    if parts:
+        yield (''.join(parts),) + first
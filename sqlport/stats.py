@@ -0,0 +1,230 @@
+"""
+Wall time and call counts per phase of porting, plus counters such as
+the number of tokens, the nodes by class and the bytes written.
+
+Nothing is collected unless a Stats is activated with collect(), the
+instrumented functions then only look up the module global active. The
+time of a phase does not include the phases running inside it, so lex
+time is not counted again for parse and width time not for render.
+Collection is process wide, it does not separate threads.
+"""
+
+import json
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+from inspect import isgeneratorfunction
+
+# the Stats being collected, or None
+active = None
+
+class Stats:
+    def __init__(self):
+        self.wall = 0.0
+        # name -> [calls, seconds]
+        self.phases = {}
+        self.counters = {}
+        # class name -> count
+        self.nodes = {}
+        # [name, start] of the running phases, innermost last
+        self.stack = []
+
+    def enter(self, name):
+        now = perf_counter()
+        stack = self.stack
+        if stack:
+            outer = stack[-1]
+            self.phases[outer[0]][1] += now - outer[1]
+        stack.append([name, now])
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = [0, 0.0]
+        entry[0] += 1
+
+    def leave(self):
+        now = perf_counter()
+        name, start = self.stack.pop()
+        self.phases[name][1] += now - start
+        if self.stack:
+            self.stack[-1][1] = now
+
+    @contextmanager
+    def phase(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def iterate(self, name, iterable, counter=None, batch=1):
+        """
+        Yields the items of iterable, timing the production of each
+        batch of up to batch items as phase name and counting them as
+        counter, if given. Items are produced a batch ahead of the
+        consumer. Returns the return value of iterable if it is a
+        generator.
+        """
+        iterator = iter(iterable)
+        count = 0
+        items = []
+        try:
+            while True:
+                stop = None
+                self.enter(name)
+                try:
+                    for i in range(batch):
+                        items.append(next(iterator))
+                except StopIteration as e:
+                    stop = e
+                finally:
+                    self.leave()
+                for item in items:
+                    count += 1
+                    yield item
+                if stop is not None:
+                    return stop.value
+                items.clear()
+        finally:
+            if counter:
+                self.count(counter, count)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_nodes(self, tree):
+        from . node import Node, nodewalk
+        if not isinstance(tree, Node):
+            return
+        nodes = self.nodes
+        for frame in nodewalk(tree):
+            name = type(frame.node).__name__
+            nodes[name] = nodes.get(name, 0) + 1
+
+    def merge(self, other):
+        """
+        Adds other, a Stats or the result of its as_dict(), to self.
+        """
+        if isinstance(other, Stats):
+            other = other.as_dict()
+        self.wall += other['wall']
+        for name, entry in other['phases'].items():
+            mine = self.phases.setdefault(name, [0, 0.0])
+            mine[0] += entry['calls']
+            mine[1] += entry['seconds']
+        for name, n in other['counters'].items():
+            self.count(name, n)
+        for name, n in other['nodes'].items():
+            self.nodes[name] = self.nodes.get(name, 0) + n
+
+    def tokens_per_second(self):
+        """
+        The lexer throughput, tokens per second spent in phase lex.
+        """
+        seconds = self.phases.get('lex', (0, 0.0))[1]
+        if not seconds:
+            return 0.0
+        return self.counters.get('tokens', 0) / seconds
+
+    def as_dict(self):
+        return {
+            'wall': self.wall,
+            'phases': { name: {'calls': calls, 'seconds': seconds}
+                        for name, (calls, seconds) in self.phases.items() },
+            'counters': dict(self.counters),
+            'tokens_per_second': self.tokens_per_second(),
+            'nodes': dict(sorted(self.nodes.items(), key=lambda x: (-x[1], x[0]))),
+        }
+
+    def report(self, fh, title):
+        fh.write("{}\n".format(title))
+        fh.write("  {:<24}{:>10}{:>12}\n".format('phase', 'calls', 'seconds'))
+        for name, (calls, seconds) in sorted(self.phases.items(), key=lambda x: -x[1][1]):
+            fh.write("  {:<24}{:>10}{:>12.3f}\n".format(name, calls, seconds))
+        fh.write("  {:<24}{:>10}{:>12.3f}\n".format('wall', '', self.wall))
+        for name, n in sorted(self.counters.items()):
+            fh.write("  {:<24}{:>10}\n".format(name, n))
+        fh.write("  {:<24}{:>10.0f}\n".format('tokens/s', self.tokens_per_second()))
+        if self.nodes:
+            # the most frequent classes, as_dict() has all of them
+            nodes = sorted(self.nodes.items(), key=lambda x: (-x[1], x[0]))
+            text = ', '.join('{} {}'.format(name, n) for name, n in nodes[:10])
+            if len(nodes) > 10:
+                text += ', ...'
+            fh.write("  {:<24}{:>10}  {}\n".format('nodes', sum(self.nodes.values()), text))
+
+@contextmanager
+def collect(stats):
+    """
+    Collect into stats inside the with block, adding its wall time.
+    Nothing is collected in the block if stats is None.
+    """
+    global active
+    previous = active
+    active = stats
+    start = perf_counter()
+    try:
+        yield stats
+    finally:
+        if stats is not None:
+            stats.wall += perf_counter() - start
+        active = previous
+
+def phase(name):
+    """
+    Decorates a function, or a generator function, to be timed as phase
+    name while stats are collected.
+    """
+    def decorator(func):
+        if isgeneratorfunction(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if active is None:
+                    return (yield from func(*args, **kwargs))
+                return (yield from active.iterate(name, func(*args, **kwargs)))
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                stats = active
+                if stats is None:
+                    return func(*args, **kwargs)
+                stats.enter(name)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stats.leave()
+        return wrapper
+    return decorator
+
+class CountingFile:
+    """
+    Passes text on to fh, counting the bytes written as UTF-8.
+    """
+    def __init__(self, fh, stats, counter='bytes_written'):
+        self.fh = fh
+        self.stats = stats
+        self.counter = counter
+
+    def write(self, text):
+        self.stats.count(self.counter, len(text.encode('utf-8', 'surrogatepass')))
+        return self.fh.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.fh, name)
+
+def write_report(files, fh, fmt='text'):
+    """
+    Writes the stats of files, a dict of names and Stats, and their
+    total to fh as text or as JSON.
+    """
+    total = Stats()
+    for stats in files.values():
+        total.merge(stats)
+    if fmt == 'json':
+        json.dump({'files': { name: stats.as_dict() for name, stats in files.items() },
+                   'total': total.as_dict()}, fh, indent=2)
+        fh.write('\n')
+        return
+    for name, stats in files.items():
+        stats.report(fh, name)
+    if len(files) > 1:
+        total.report(fh, 'total')
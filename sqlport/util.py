@@ -1,4 +1,6 @@
 
+from . node import Node
+
 def pretty_print(obj, indent=0, key=None, showNone=True, done=None):
     print('|   ' * indent + (str(key)+": " if key != None else "") + type(obj).__name__ +  ':')
     if done == None:
@@ -10,10 +12,13 @@ def pretty_print(obj, indent=0, key=None, showNone=True, done=None):
     indent += 1
     if isinstance(obj, (list,tuple)):
         children = enumerate(obj)
+    elif isinstance(obj, Node):
+        # parent links are set for every node, the nesting shows them
+        children = [ (key, getattr(obj, key)) for key in obj._fields + ('_width',) if hasattr(obj, key) ]
     else:
         children = obj.__dict__.items()
     for key,value in children:
-        if hasattr(value, '__dict__') or isinstance(value, (list,tuple)):
+        if hasattr(value, '__dict__') or isinstance(value, (Node,list,tuple)):
             pretty_print(value, indent, key, showNone, done)
         elif value != None or showNone:
             print('|   ' * indent +  str(key) + ': ' + repr(value))
@@ -565,6 +565,9 @@ class InformixWriter:
     def BlockComment(self):
         yield '{ ', self.text, ' }'
 
+    def UnparsedStatement(self):
+        yield BlockComment(NotSupported("syntax error")), '\n', self.text
+
     def String(self):
         yield self.value
 
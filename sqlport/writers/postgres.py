@@ -3,6 +3,7 @@ import sys
 import re
 from .. node import *
 from .. util import join_list, pretty_print
+from .. import stats
 from . informix import InformixWriter
 from functools import reduce
 
@@ -53,6 +54,7 @@ def ensure_name_prefix(prefix, obj):
     if not obj.name.startswith(prefix):
         obj.name = "pk_" + obj.name
 
+@stats.phase('fix_declarations')
 def fix_declarations(proc):
     fixed = StatementList()
     for dec in proc.declarations:
@@ -61,8 +63,9 @@ def fix_declarations(proc):
                 fixed.append(Define((name,), dec.type))
         else:
             fixed.append(dec)
-    proc.declarations = fixed
+    proc.setchild('declarations', fixed)
 
+@stats.phase('fix_foreach')
 def fix_foreach(proc):
     """
     - find foreach loops
@@ -73,7 +76,7 @@ def fix_foreach(proc):
     loops = find_nodes(proc, lambda obj: isinstance(obj, ForEach), True)
     for i, loop in enumerate(loops):
         loop.record = "__rec{}__".format(i+1)
-        proc.declarations.append(Define((loop.record,), "RECORD"))
+        proc.declarations.appendchild(Define((loop.record,), "RECORD"))
         if loop.select.into_vars:
             loop.variables = [ x.writeout() for x in loop.select.into_vars ]
             loop.select.into_vars = None
@@ -82,6 +85,7 @@ def fix_foreach(proc):
         else:
             loop.variables = []
     
+@stats.phase('fix_outer')
 def fix_outer(select):
     if not len(list(find_nodes(select.table,
                                lambda obj: isinstance(obj, Outer),
@@ -89,7 +93,6 @@ def fix_outer(select):
         return
     tables_done = set()
     while True:
-        select.set_parents()
         tables = list(find_nodes(select.table,
                                  lambda obj: isinstance(obj, (As, EntityRef, Outer)),
                                  lambda obj, key, value: not isinstance(obj, (As, Outer)) and key != "on"))
@@ -171,16 +174,16 @@ def convert_string(text):
         return "'" + (text[1:-1].replace('""','"').replace("'","''")) + "'"
     return text
 
+@stats.phase('move_exception_handlers')
 def move_exception_handlers(procedure):
-    procedure.set_parents()
     move_list = []
-    for obj, parents, path in list(nodewalk(procedure)):
-        if isinstance(obj, OnException):
-            move_list.append(obj)
+    for frame in nodewalk(procedure):
+        if isinstance(frame.node, OnException):
+            move_list.append(frame.node)
     for obj in move_list:
         parent = obj.parent
         obj.detach()
-        parent.append(obj)
+        parent.appendchild(obj)
 
 errorMap = {
     "-206": "undefined_table",
@@ -374,7 +377,6 @@ class PostgresWriter(InformixWriter):
         fix_declarations(self)
         fix_foreach(self)
         move_exception_handlers(self)
-        self.set_parents()
         # if self.returning:
         #     proc_type = 'FUNCTION'
         # else:
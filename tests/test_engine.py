@@ -0,0 +1,334 @@
+import pytest
+from io import StringIO
+from sqlport.engine import parse, port_stream
+from sqlport.splitter import split_statements
+from . support import onerror, port
+
+def test_split_statements():
+    i = """{ header; comment }
+    select "a;b", 'c''d;' from t; -- trailing ; comment
+    create procedure p()
+      define x int;
+      let x = 1;
+    end procedure;
+    ;;
+    drop table x"""
+    assert [ (text.split()[0], lineno, column) for text, lineno, column in split_statements(StringIO(i)) ] == [
+        ('{', 1, 1), ('--', 2, 34), ('drop', 7, 7)]
+
+def test_split_chunks():
+    from sqlport.splitter import split_chunks
+    i = """select a from b;
+    create procedure p()
+      define x int;
+      let x = 1;
+    end procedure;
+    ;
+
+    select first 1 c from d;
+    select e from f
+    """
+    chunks = list(split_chunks(StringIO(i), 20))
+    assert [ (lineno, column) for text, lineno, column in chunks ] == [(1, 1), (6, 6), (8, 29)]
+    assert chunks[0][0].endswith("end procedure")
+    assert ''.join(parse(text, onerror=onerror).render() for text, lineno, column in chunks) == \
+        parse(i, onerror=onerror).render()
+    errors = []
+    parse(chunks[2][0], onerror=lambda obj, t: errors.append(t.lineno), lineno=chunks[2][1])
+    assert errors == []
+    text, lineno, column = list(split_chunks(StringIO(i.replace('select e', 'select select')), 1000))[0]
+    parse(text, onerror=lambda obj, t: errors.append(t.lineno), lineno=lineno)
+    assert errors == [9]
+
+def test_statement_inside_line(capsys):
+    from sqlport.parser import SqlParser
+    from sqlport.engine import parse_stream
+    i = "select a from b;\nselect c from d; select ( from e;"
+    parser = SqlParser()
+    errors = []
+    def onerror(obj, t):
+        errors.append(obj.position(t.index))
+    list(parse_stream(StringIO(i), onerror=onerror, parser=parser))
+    parse(i, onerror=onerror, parser=parser)
+    assert errors == [(2, 27), (2, 27)]
+    stream_err, whole_err = capsys.readouterr().err.split('Syntax Error')[1:]
+    assert stream_err.split('\n')[1].index('select (') == whole_err.split('\n')[1].index('select (') == 17
+
+def test_max_errors_split(tmp_path):
+    import os
+    import sys
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = tmp_path / 'a.sql'
+    path.write_text(''.join('select a, b from t{};\n'.format(i) if i % 150 else 'select ( from e{};\n'.format(i)
+                            for i in range(1, 451)))
+    def run(*options):
+        result = subprocess.run([sys.executable, os.path.join(root, 'bin', 'sqlport'), '-e', '2'] + list(options) + [str(path)],
+                                capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=root))
+        return result.returncode, result.stderr.count('Syntax Error')
+    assert run() == run('-s') == run('-j', '2', '--split', '4') == run('-j', '2', '--split', '4', '-s') == (0, 2)
+    # --split without --jobs is rejected
+    assert run('--split', '4') == (2, 0)
+
+def test_port_stream():
+    i = """
+    select first 1 a from b;
+    create procedure p()
+      define x int;
+      let x = 1;
+    end procedure;
+    select a, b from c, outer(d) where c.x = d.x
+    """
+    outfh = StringIO()
+    trees = list(port_stream(StringIO(i), outfh, onerror=onerror))
+    assert len(trees) == 3
+    assert outfh.getvalue() == parse(i, onerror=onerror).render()
+
+def test_width_measured_once():
+    from sqlport.node import Select, find_nodes
+    e = 'a'
+    for i in range(25):
+        e = '(select g({}, b{}) from t{})'.format(e, i, i)
+    tree = parse('select {} from t'.format(e), onerror=onerror)
+    select = tree[0]
+    width = select.width
+    selects = list(find_nodes(select, lambda x: isinstance(x, Select), True))
+    assert len(selects) == 26
+    assert all(hasattr(x, '_width') for x in selects)
+    assert width == len(select.writeout())
+
+def test_indent_writer():
+    from sqlport.node import IndentWriter, Indent, Dedent
+    fragments = ['BEGIN\n', Indent, 'x', ' := 1;\n\n', 'IF', Indent + ' y\nz' + Dedent, '\n', Dedent, 'END']
+    outfh = StringIO()
+    writer = IndentWriter(outfh)
+    for fragment in fragments:
+        writer.write(fragment)
+    assert outfh.getvalue() == 'BEGIN\n  x := 1;\n\n  IF y\n    z\nEND'
+    outfh = StringIO()
+    IndentWriter(outfh).write(''.join(fragments))
+    assert outfh.getvalue() == 'BEGIN\n  x := 1;\n\n  IF y\n    z\nEND'
+
+def test_writeout_deep_expression():
+    i = 'select a from t where ' + ' or '.join('x = {}'.format(n) for n in range(3000))
+    assert port(i) == 'SELECT\n  a\nFROM t\nWHERE ' + ' OR '.join('x = {}'.format(n) for n in range(3000)) + ';'
+
+def test_node_slots():
+    from sqlport import node
+    classes = [ x for x in vars(node).values() if isinstance(x, type) and issubclass(x, node.Node) ]
+    assert [ x.__name__ for x in classes if x.__dictoffset__ ] == []
+    assert node.SubSelect._fields == node.Select._fields
+    tree = parse('select a from b where c = 1', onerror=onerror)
+    assert [ key for key, value in tree[0].children ] == ['columns', 'table', 'where']
+
+def test_nodewalk():
+    from sqlport.node import nodewalk, Operator
+    select = parse('select a from b where c = 1 and d = 2', onerror=onerror)[0]
+    frames = list(nodewalk(select))
+    assert frames[0].node is select and frames[0].parent is None
+    ops = [ x for x in frames if isinstance(x.node, Operator) ]
+    assert [ x.node.op for x in ops ] == ['AND', '=', '=']
+    assert ops[1].path == ('where', 'left')
+    assert ops[1].parents == (select, select.where)
+    post = [ x.node for x in nodewalk(select, postorder=True) ]
+    assert post[-1] is select and sorted(map(id, post)) == sorted(id(x.node) for x in frames)
+    pruned = [ x.node for x in nodewalk(select, prune=lambda x: isinstance(x.node, Operator)) ]
+    assert select.where in pruned and select.where.left not in pruned
+
+def test_find_nodes_deep_procedure():
+    expr = ' || '.join('x' for n in range(3000))
+    i = 'create procedure p() define x char(10); let x = ' + expr + '; end procedure'
+    assert expr in port(i)
+
+def test_parent_links_maintained():
+    from sqlport.node import nodewalk
+    i = '''create procedure p()
+    define x int;
+    define y int;
+    foreach select a, b into x, y from c, outer(d), outer(e) where c.x = d.x and d.y = e.y
+    end foreach;
+    on exception in (-206)
+        let x = 0;
+    end exception
+    end procedure'''
+    tree = parse(i, onerror=onerror)
+    tree.render()
+    for frame in nodewalk(tree):
+        if frame.up is not None:
+            assert frame.node.parent is frame.up.node
+            assert frame.node.parent_key == frame.key
+
+def test_translation_cache(tmp_path, monkeypatch):
+    from sqlport.engine import port_text, TranslationCache, SqlParser
+    i = 'select a from b;\nselect first 1 c from d;\n'
+    expected = StringIO()
+    port_text(i, expected)
+    cache = TranslationCache(str(tmp_path))
+    outfh = StringIO()
+    port_text(i, outfh, cache=cache)
+    assert outfh.getvalue() == expected.getvalue()
+    def fail(*args):
+        assert False
+    monkeypatch.setattr(SqlParser, 'parse', fail)
+    # whole text and single statements are cached
+    for text in (i, 'select first 1 c from d'):
+        outfh = StringIO()
+        port_text(text, outfh, cache=cache)
+        assert outfh.getvalue() in expected.getvalue()
+    assert outfh.getvalue() == 'SELECT c FROM d LIMIT 1;\n\n'
+
+def test_translation_cache_errors(tmp_path):
+    from sqlport.engine import port_text, TranslationCache
+    cache = TranslationCache(str(tmp_path))
+    errors = []
+    port_text('select from;', StringIO(), onerror=lambda obj, t: errors.append(t), cache=cache)
+    assert errors
+    assert list(cache.entries()) == []
+
+def test_translation_cache_eviction(tmp_path):
+    from sqlport.engine import TranslationCache
+    cache = TranslationCache(str(tmp_path), 1000)
+    keys = [ cache.key('select {}'.format(n)) for n in range(20) ]
+    for key in keys:
+        cache.put(key, 'x' * 100)
+    assert cache.size <= 1000
+    assert cache.size == sum(size for mtime, size, path in cache.entries())
+    assert cache.get(keys[-1]) == 'x' * 100
+
+def test_translator():
+    from sqlport.engine import Translator
+    translator = Translator()
+    assert translator.translate('select first 1 a from b') == 'SELECT a FROM b LIMIT 1;\n\n'
+    assert translator.translate('select "x" from c') == "SELECT 'x' FROM c;\n\n"
+    assert Translator('informix').translate('select first 1 a from b') == 'SELECT FIRST 1 a FROM b;\n\n'
+    assert translator.translate('select first 1 a from b') == 'SELECT a FROM b LIMIT 1;\n\n'
+
+def test_concurrent_writers():
+    from threading import Thread
+    from sqlport.engine import Translator
+    i = 'select first 1 a from b'
+    expected = {
+        'postgres': 'SELECT a FROM b LIMIT 1;\n\n',
+        'informix': 'SELECT FIRST 1 a FROM b;\n\n',
+    }
+    results = []
+    def run(name):
+        translator = Translator(name)
+        results.extend(translator.translate(i) == expected[name] for n in range(200))
+    threads = [ Thread(target=run, args=(name,)) for name in ('postgres', 'informix') * 2 ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 800 and all(results)
+
+def test_dispatch_table():
+    from sqlport.node import DispatchTable, NodeList, Select, render_context
+    from sqlport.engine import writers
+    for writer in writers.values():
+        table = DispatchTable(writer)
+        assert table[Select] is writer.Select
+    class Writer(writers['postgres']):
+        Select = None
+    with pytest.raises(NotImplementedError, match='^Writer has no function for Select$'):
+        DispatchTable(Writer)
+    with pytest.raises(NotImplementedError):
+        with render_context(Writer):
+            pass
+    with render_context(writers['postgres']):
+        with pytest.raises(NotImplementedError):
+            NodeList().writeout()
+
+def test_mapped_source(tmp_path, capsys):
+    from sqlport.source import map_file
+    i = "select 'café' from t;\ncreate procedure p()\n  define x int;\n  let x = 1;\nend procedure;\n"
+    path = tmp_path / 'a.sql'
+    path.write_text(i, encoding='utf-8')
+    source = map_file(str(path))
+    assert parse(source, onerror=onerror).render() == parse(i, onerror=onerror).render()
+    source.close()
+    path.write_text("select 'é' from t where ) x;\n", encoding='utf-8')
+    source = map_file(str(path))
+    errors = []
+    parse(source, onerror=lambda obj, t: errors.append(t.index))
+    source.close()
+    assert errors == [25]
+    assert "select 'é' from t where " in capsys.readouterr().err
+    (tmp_path / 'empty.sql').write_text('')
+    assert parse(map_file(str(tmp_path / 'empty.sql'))) == parse('')
+
+def test_stats():
+    import json
+    from sqlport.stats import Stats, collect, write_report
+    from sqlport.engine import port_text, SqlLexer
+    i = """
+    create procedure p()
+      define a, b int;
+      foreach select x into a from t
+        let b = a;
+      end foreach;
+      on exception end exception;
+    end procedure;
+    select a from b, outer(c) where b.x = c.x
+    """
+    tokens = len(list(SqlLexer().tokenize(i)))
+    stats = Stats()
+    with collect(stats):
+        port_text(i, StringIO())
+    phases = { name: calls for name, (calls, seconds) in stats.phases.items() }
+    assert set(phases) >= {'lex', 'parse', 'render', 'width', 'indent', 'fix_outer', 'fix_foreach',
+                           'fix_declarations', 'move_exception_handlers'}
+    assert phases['parse'] == 1 and phases['fix_foreach'] == 1
+    assert stats.counters['tokens'] == tokens
+    assert phases['lex'] == tokens // 64 + 1
+    assert stats.tokens_per_second() == tokens / stats.phases['lex'][1]
+    assert stats.nodes['CreateProcedure'] == 1 and stats.nodes['Select'] == 2
+    assert stats.wall >= sum(seconds for calls, seconds in stats.phases.values())
+    total = Stats()
+    total.merge(stats.as_dict())
+    total.merge(stats)
+    assert total.counters['tokens'] == 2 * tokens
+    out = StringIO()
+    write_report({'a.sql': stats, 'b.sql': stats}, out, 'json')
+    assert json.loads(out.getvalue())['total']['counters']['tokens'] == 2 * tokens
+    with collect(None):
+        port_text(i, StringIO())
+    assert stats.counters['tokens'] == tokens
+
+def test_stats_generator():
+    from sqlport import stats
+    @stats.phase('gen')
+    def gen():
+        yield None
+        yield 0
+        return 'done'
+    for collector in (None, stats.Stats()):
+        with stats.collect(collector):
+            result = []
+            iterator = gen()
+            try:
+                while True:
+                    result.append(next(iterator))
+            except StopIteration as stop:
+                result.append(stop.value)
+        assert result == [None, 0, 'done']
+    assert collector.phases['gen'][0] == 3
+    collector = stats.Stats()
+    items = list(collector.iterate('gen', [None] * 5, 'items', 2))
+    assert items == [None] * 5 and collector.phases['gen'][0] == 3 and collector.counters['items'] == 5
+
+def test_profile(tmp_path):
+    import pstats
+    from sqlport.profiling import profile
+    from sqlport.engine import port_text
+    i = 'select a from b, outer(c) where b.x = c.x'
+    with profile(str(tmp_path / 'x' / 'a.sql')):
+        port_text(i, StringIO())
+    stats = pstats.Stats(str(tmp_path / 'x' / 'a.sql.pstats'))
+    assert any(name == 'fix_outer' for filename, lineno, name in stats.stats)
+    stacks = [ line.rsplit(' ', 1) for line in (tmp_path / 'x' / 'a.sql.collapsed').read_text().splitlines() ]
+    assert all(int(value) > 0 for stack, value in stacks)
+    assert any('port_text (engine.py' in stack and 'fix_outer (postgres.py' in stack for stack, value in stacks)
+    with profile(str(tmp_path / 'b.sql'), threshold=60):
+        port_text(i, StringIO())
+    assert not (tmp_path / 'b.sql.pstats').exists()
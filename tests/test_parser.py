@@ -580,3 +580,128 @@ def test_type_expr():
 # def test_empty():
 # def test_parse():
 # def test_error():
+
+def test_lrtable_cache(tmp_path, monkeypatch):
+    import os
+    import sys
+    import subprocess
+    from sqlport.parser import SqlParser
+    from sqlport import lrcache
+    monkeypatch.setenv('SQLPORT_LRCACHE_DIR', str(tmp_path))
+    lrtable = SqlParser._lrtable
+    signature = lrcache.grammar_signature(SqlParser)
+    # build the tables from scratch in a process without any cache
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', 'import sqlport.parser'], check=True,
+                   env=dict(os.environ, PYTHONPATH=root, HOME=str(tmp_path), SQLPORT_LRCACHE_DIR=str(tmp_path)))
+    assert (tmp_path / lrcache.CACHE_FILE).exists()
+    assert lrcache.load(signature) == (lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    assert lrcache.save(signature, lrtable)
+    assert lrcache.load(signature) == (lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    assert lrcache.load('x' + signature[1:]) is None
+
+def test_keyword_names(monkeypatch):
+    from sqlport import lexer
+    monkeypatch.setattr(lexer, 'max_names', len(lexer.names) + 2)
+    def lex(text):
+        return [ (t.type, t.value) for t in lexer.SqlLexer().tokenize(text) ]
+    expected = [('SELECT', 'SELECT'), ('NAME', 'Foo'), ('FROM', 'FROM'), ('NAME', 'bar_1')]
+    for i in range(3):
+        assert lex('SeLeCt Foo fRoM bar_1') == expected
+        assert lex('select x{} from y'.format(i))[1] == ('NAME', 'x{}'.format(i))
+
+def test_comments():
+    from sqlport.lexer import SqlLexer
+    def lex(text, onerror=onerror):
+        return [ (t.type, t.value, t.lineno, t.index) for t in SqlLexer().tokenize(text, onerror) ]
+    assert lex('a {x\n}\n/* y\n\n*/ b -- z\n  c -- end') == [
+        ('NAME', 'a', 1, 0), ('NAME', 'b', 5, 16), ('NAME', 'c', 6, 25)]
+    errors = []
+    assert lex('a /* b\nc', lambda obj, t: errors.append(t)) == [('NAME', 'a', 1, 0)]
+    assert len(errors) == 1
+
+def test_scanner():
+    from sqlport.lexer import SqlLexer
+    from sqlport.scanner import SqlScanner
+    texts = [
+        'select a, "b" from c where d <> 1 and e::int >= 2 -- x',
+        'create procedure p() { c\n} let x = y || \'z\'; /**/ */\nend procedure; $$ :',
+        'a\t \n\n  b ` c\r\nd /* e',
+    ]
+    for text in texts:
+        result = []
+        for cls in SqlLexer, SqlScanner:
+            errors = []
+            tokens = [ (t.type, t.value, t.lineno, t.index, t.end)
+                       for t in cls().tokenize(text, lambda obj, t: errors.append((t.index, t.lineno))) ]
+            result.append((tokens, errors))
+        assert result[0] == result[1]
+    assert result[0][1] == [(9, 3), (12, 3), (16, 4)]
+
+def test_scanner_tokens():
+    from sqlport.scanner import SqlScanner
+    text = "select 'a long string', 42 from t"
+    tokens = list(SqlScanner().tokenize(text))
+    string = tokens[1]
+    assert string.type == 'STRING' and string._value is None
+    assert string.value == "'a long string'" and string._value is string.value
+    assert repr(tokens[0]) == "Token(type='SELECT', value='SELECT', lineno=1, index=0, end=6)"
+    from sqlport.engine import Translator
+    assert Translator(lexer='scanner').translate(text) == "SELECT 'a long string', 42 FROM t;\n\n"
+
+def test_line_index():
+    from sqlport.source import LineIndex
+    from sqlport.parser import SqlParser
+    from sqlport.engine import parse
+    text = 'select a\nfrom b;\n\ncreate procedure p()\nend procedure;'
+    lines = LineIndex(text, 3)
+    assert lines.position(text.index('from')) == (4, 1)
+    assert lines.scanned == text.index('\n\n') + 1
+    assert lines.bounds(text.index('b;')) == (9, 16)
+    assert lines.bounds(len(text)) == (text.index('end'), len(text))
+    assert lines.position(text.index('p()')) == (6, 18)
+    assert LineIndex(text.encode()).position(text.index('end')) == (5, 1)
+    mapped = 'a\nselect \'é\', x'.encode()
+    assert LineIndex(mapped).position(mapped.index(b'x')) == (2, 13)
+    parser = SqlParser()
+    tree = parse(text, onerror=onerror, parser=parser, lineno=3)
+    assert parser.position(tree[1].index) == (6, 1)
+
+def test_error_recovery(capsys):
+    from sqlport.engine import parse
+    i = """
+    select from from;
+    select a from b;
+    create procedure p()
+      let x = = 1;
+      select c from d;
+    end procedure;
+    select first 1 e from f;
+    select g from
+    """
+    errors = []
+    tree = parse(i, onerror=lambda obj, t: errors.append(t and t.value))
+    assert errors == ['FROM', '=', None]
+    assert [ type(x).__name__ for x in tree ] == [
+        'UnparsedStatement', 'Select', 'UnparsedStatement', 'Select', 'UnparsedStatement']
+    assert tree[2].text.startswith('create procedure p()') and tree[2].text.endswith('end procedure')
+    assert tree.render() == (
+        "/* NOT_SUPPORTED: syntax error */\nselect from from;\n\n"
+        "SELECT a FROM b;\n\n"
+        "/* NOT_SUPPORTED: syntax error */\n" + tree[2].text + ";\n\n"
+        "SELECT e FROM f LIMIT 1;\n\n"
+        "/* NOT_SUPPORTED: syntax error */\nselect g from;\n\n")
+
+def test_error_recovery_after_procedure(capsys):
+    from sqlport.engine import parse
+    i = """create procedure p() end procedure
+    select a from t;
+    create procedure q() let x = 1; end procedure;
+    select b from u;"""
+    tree = parse(i, onerror=lambda obj, t: None)
+    assert [ type(x).__name__ for x in tree if x is not None ] == ['UnparsedStatement', 'CreateProcedure', 'Select']
+    assert tree[0].text.endswith('select a from t')
+    i = "create procedure p() end procedure garbage; select a from t; select b from u"
+    tree = parse(i, onerror=lambda obj, t: None)
+    assert tree[0].text == 'create procedure p() end procedure garbage'
+    assert tree.render().endswith("SELECT a FROM t;\n\nSELECT b FROM u;\n\n")